@@ -0,0 +1,88 @@
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session
+from app.api.chat_ws import publish_chat_message
+from app.core.config import settings
+from app.db.models import User
+from app.db.session import engine
+from app.services.auth_service import get_current_user
+from app.services.attachment_service import store_upload, blob_path, attachment_payload, download_headers
+from app.services.chat_service import send_attachment_message, get_attachment, is_user_member
+from app.services.unread_service import unread_counters
+from app.utils.file_response import RangeFileResponse
+
+router = APIRouter(prefix="/chat", tags=["chat-attachments"])
+
+
+def _check_member(user_id: int, room_id: int):
+    with Session(engine) as session:
+        if not is_user_member(user_id, room_id, session):
+            raise HTTPException(status_code=403, detail="Not a member of this room")
+
+
+def _post_attachment(
+    room_id: int, sender: User, sha256: str, size: int, content_type: str, filename: str, caption: str,
+) -> tuple[dict, set[int]]:
+    """Record a stored upload as a message; returns its payload and the room's members."""
+    with Session(engine) as session:
+        msg, attachment = send_attachment_message(
+            room_id, sender, session,
+            sha256=sha256, size=size, content_type=content_type, filename=filename, caption=caption,
+        )
+        members = unread_counters.members(room_id, session)
+
+        # Only the reference goes over the WebSocket; clients fetch the bytes on demand
+        message_payload = {
+            "type": "chat_message",
+            "id": msg.id,
+            "sender": sender.username,
+            "content": msg.content,
+            "timestamp": msg.timestamp.isoformat(),
+            "attachment": attachment_payload(attachment),
+        }
+    return message_payload, members
+
+
+# Upload a file to a room. The raw request body is the file; it is streamed to disk.
+# Async for the body stream; the blocking DB work runs in the threadpool.
+@router.post("/rooms/{room_id}/attachments")
+async def upload_attachment(
+    room_id: int,
+    request: Request,
+    filename: str,
+    caption: str = "",
+    current_user: User = Depends(get_current_user),
+):
+    await run_in_threadpool(_check_member, current_user.id, room_id)
+
+    declared = request.headers.get("content-length")
+    if declared and int(declared) > settings.attachment_max_bytes:
+        raise HTTPException(status_code=413, detail="Attachment too large")
+
+    sha256, size = await store_upload(request.stream(), settings.attachment_max_bytes)
+    content_type = request.headers.get("content-type") or "application/octet-stream"
+
+    message_payload, members = await run_in_threadpool(
+        _post_attachment, room_id, current_user, sha256, size, content_type, filename, caption,
+    )
+    await publish_chat_message(room_id, message_payload, members)
+    return message_payload
+
+
+# Download an attachment (members only), with Range support
+@router.get("/attachments/{attachment_id}")
+def download_attachment(attachment_id: int, request: Request, current_user: User = Depends(get_current_user)):
+    with Session(engine) as session:
+        attachment = get_attachment(attachment_id, current_user, session)
+
+    media_type, headers = download_headers(attachment)
+    return RangeFileResponse(
+        blob_path(attachment.sha256),
+        request_headers=request.headers,
+        media_type=media_type,
+        headers={
+            "ETag": f'"{attachment.sha256}"',
+            "Cache-Control": "private, max-age=31536000, immutable",
+            **headers,
+        },
+    )
@@ -1,56 +1,125 @@
 from fastapi import APIRouter, Depends, Request, Form, HTTPException
-from sqlmodel import Session, select
+from sqlmodel import Session
 from fastapi.responses import RedirectResponse
 from app.services.chat_service import (
     get_user_rooms, get_room, create_room, join_room_service,
-    leave_room_service, get_membership_map
+    leave_room_service, get_room_directory, is_user_member, read_history
+)
+from app.services.history_service import (
+    HISTORY_TEMPLATE, HISTORY_VERSION, history_pages, history_page_url, history_etag
 )
 from app.services.auth_service import get_current_user
+from app.services.unread_service import unread_counters
 from app.db.models import User, ChatRoom
 from app.db.session import get_session
 from app.utils.templates import templates
+from app.core.config import settings
+from app.utils.http_cache import (
+    FragmentCache, IMMUTABLE_CACHE_CONTROL, cached_template_response, directory_etag
+)
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+# Rendered closed history pages; never invalidated, since they never change
+history_cache = FragmentCache(max_entries=settings.history_cache_entries)
+
 
 # Main chat page
 @router.get("")
 def chat(request: Request, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
-    rooms = session.exec(select(ChatRoom)).all()
-    membership_map = get_membership_map(current_user.id, session)
-    return templates.TemplateResponse(
-        "rooms.html",
-        {
-            "request": request,
+    def build_context():
+        rooms, membership_map = get_room_directory(current_user.id, session)
+        return {
             "rooms": rooms,
             "user": current_user,
             "selected_room": None,
             "messages": [],
             "membership_map": membership_map,
+            "unread_map": unread_counters.get_unread_map(current_user.id),
         }
-    )
+
+    etag = directory_etag("rooms", current_user.id, unread_counters.version(current_user.id))
+    return cached_template_response(request, "rooms.html", etag, build_context)
 
 
 # Open a room page
 @router.get("/rooms/{room_id}")
 def chat_room(room_id: int, request: Request, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
-    rooms = session.exec(select(ChatRoom)).all()
-    selected_room = session.get(ChatRoom, room_id)
-    if not selected_room:
-        raise HTTPException(status_code=404, detail="Room not found")
+    def build_context():
+        rooms, membership_map = get_room_directory(current_user.id, session)
+        selected_room = session.get(ChatRoom, room_id)  # already in the identity map
+        if not selected_room:
+            raise HTTPException(status_code=404, detail="Room not found")
 
-    membership_map = get_membership_map(current_user.id, session)
-
-    return templates.TemplateResponse(
-        "rooms.html",
-        {
-            "request": request,
+        return {
             "rooms": rooms,
             "user": current_user,
             "selected_room": selected_room,
             "messages": [],  # messages now handled via WebSocket
             "membership_map": membership_map,
+            "unread_map": unread_counters.get_unread_map(current_user.id),
         }
+
+    etag = directory_etag("rooms", current_user.id, unread_counters.version(current_user.id), room_id)
+    return cached_template_response(request, "rooms.html", etag, build_context)
+
+
+# Room list fragment (sidebar), for HTMX refreshes
+@router.get("/room-list")
+def room_list(request: Request, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    def build_context():
+        rooms, membership_map = get_room_directory(current_user.id, session)
+        return {
+            "rooms": rooms,
+            "selected_room": None,
+            "membership_map": membership_map,
+            "unread_map": unread_counters.get_unread_map(current_user.id),
+        }
+
+    etag = directory_etag("room-list", current_user.id, unread_counters.version(current_user.id))
+    return cached_template_response(request, "partials/room_list.html", etag, build_context)
+
+
+# Newest (open) history page: the only one that changes
+@router.get("/rooms/{room_id}/history")
+def room_history_open(room_id: int, request: Request, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    if not is_user_member(current_user.id, room_id, session):
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+
+    anchor = history_pages.anchor(room_id, session)
+
+    def build_context():
+        return {
+            "messages": read_history(room_id, session, limit=history_pages.open_count(room_id, session)),
+            "older_url": history_page_url(room_id, anchor) if anchor else None,
+        }
+
+    etag = f'"history-{room_id}-open-{history_pages.latest(room_id, session)}-{HISTORY_VERSION}"'
+    return cached_template_response(request, HISTORY_TEMPLATE, etag, build_context, cache=history_cache)
+
+
+# A closed history page: the `history_page_size` messages with id < before_id
+@router.get("/rooms/{room_id}/history/{before_id}")
+def room_history_page(room_id: int, before_id: int, request: Request, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    if not is_user_member(current_user.id, room_id, session):
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+
+    def build_context():
+        messages = read_history(room_id, session, before_id=before_id, limit=settings.history_page_size)
+        full = len(messages) == settings.history_page_size
+        return {
+            "messages": messages,
+            "older_url": history_page_url(room_id, messages[0]["id"]) if full else None,
+        }
+
+    if not history_pages.is_closed(room_id, before_id, session):
+        # Ahead of the newest message: content may still change, so don't cache it
+        return templates.TemplateResponse(
+            HISTORY_TEMPLATE, {"request": request, **build_context()}, headers={"Cache-Control": "no-store"}
+        )
+    return cached_template_response(
+        request, HISTORY_TEMPLATE, history_etag(room_id, before_id), build_context,
+        cache=history_cache, cache_control=IMMUTABLE_CACHE_CONTROL,
     )
 
 
@@ -64,10 +133,9 @@ def create_new_room(request: Request, name: str = Form(...), current_user: User
 # Join a room
 @router.post("/rooms/{room_id}/join")
 def join_room(room_id: int, request: Request, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
-    join_room_service(room_id, current_user.id, session)
-    rooms = session.exec(select(ChatRoom)).all()
-    selected_room = session.get(ChatRoom, room_id)
-    membership_map = get_membership_map(current_user.id, session)
+    user_id = current_user.id  # read before the service commits and expires it
+    selected_room = join_room_service(room_id, user_id, session)
+    rooms, membership_map = get_room_directory(user_id, session)
     return templates.TemplateResponse(
         "partials/join_leave_sync.html",
         {
@@ -75,6 +143,7 @@ def join_room(room_id: int, request: Request, current_user: User = Depends(get_c
             "rooms": rooms,
             "membership_map": membership_map,
             "selected_room": selected_room,
+            "unread_map": unread_counters.get_unread_map(user_id),
         },
     )
 
@@ -82,10 +151,9 @@ def join_room(room_id: int, request: Request, current_user: User = Depends(get_c
 # Leave a room
 @router.post("/rooms/{room_id}/leave")
 def leave_room(room_id: int, request: Request, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
-    leave_room_service(room_id, current_user.id, session)
-    rooms = session.exec(select(ChatRoom)).all()
-    selected_room = session.get(ChatRoom, room_id)
-    membership_map = get_membership_map(current_user.id, session)
+    user_id = current_user.id  # read before the service commits and expires it
+    selected_room = leave_room_service(room_id, user_id, session)
+    rooms, membership_map = get_room_directory(user_id, session)
     return templates.TemplateResponse(
         "partials/join_leave_sync.html",
         {
@@ -93,5 +161,6 @@ def leave_room(room_id: int, request: Request, current_user: User = Depends(get_
             "rooms": rooms,
             "membership_map": membership_map,
             "selected_room": selected_room,
+            "unread_map": unread_counters.get_unread_map(user_id),
         },
     )
\ No newline at end of file
@@ -0,0 +1,63 @@
+import json
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+from app.core.config import settings
+from app.db.models import User, ChatRoom
+from app.db.session import get_session
+from app.services.auth_service import get_current_user
+from app.services.chat_service import is_user_member
+from app.services.transfer_service import export_room, RoomImporter, validate_record
+
+router = APIRouter(prefix="/chat", tags=["chat-transfer"])
+
+
+# Stream a room's full history as NDJSON
+@router.get("/rooms/{room_id}/export")
+def export_room_history(room_id: int, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    if not session.get(ChatRoom, room_id):
+        raise HTTPException(status_code=404, detail="Room not found")
+    if not is_user_member(current_user.id, room_id, session):
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+
+    return StreamingResponse(
+        export_room(room_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="room-{room_id}.ndjson"'},
+    )
+
+
+# Bulk import NDJSON (same format as the export), parsed as it streams in
+@router.post("/import")
+async def import_history(request: Request, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    importer = RoomImporter(session, batch_size=settings.import_batch_size, owner=current_user)
+    line_no = 0
+
+    def parse(line: bytes) -> dict:
+        try:
+            return validate_record(json.loads(line))
+        except ValueError as e:  # includes JSONDecodeError
+            # Earlier batches are already committed: say how much of the import landed
+            raise HTTPException(status_code=400, detail={
+                "error": f"line {line_no}: {e}",
+                "line": line_no,
+                "committed": dict(importer.counts),
+            })
+
+    remainder = b""
+    async for chunk in request.stream():
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        records = []
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                records.append(parse(line))
+        if records:
+            await run_in_threadpool(importer.add_all, records)
+    if remainder.strip():
+        line_no += 1
+        await run_in_threadpool(importer.add, parse(remainder))
+
+    return await run_in_threadpool(importer.finish)
@@ -1,155 +1,331 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, status
+import asyncio
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException, status
 from sqlmodel import Session, select
 from datetime import datetime
-from app.utils.connection_manager import ConnectionManager
-from app.db.session import get_session
-from app.services.chat_service import send_message, get_room_messages, is_user_member, mark_message_seen
-from app.services.auth_service import get_current_user_ws
-from app.db.models import User, Message, MessageSeen
+from app.utils.connection_manager import Connection, ConnectionManager, UserRef
+from app.utils.rate_limit import FloodControl
+from app.utils.heartbeat import HeartbeatMonitor
+from app.utils.admission import AdmissionController
+from app.utils.query_stats import track as track_queries
+from app.db.session import engine
+from app.core.config import settings
+from app.services.chat_service import send_message, get_room_history, read_history, is_user_member, mark_message_seen
+from app.services.auth_service import get_current_user, get_current_user_ws
+from app.services.unread_service import unread_counters
+from app.services.history_service import history_pages, history_page_url
+from app.db.models import Message, MessageSeen, User
 
 router = APIRouter()
-manager = ConnectionManager()
 
+# The event loop only keeps weak references to tasks; hold evictions until they finish
+_eviction_tasks: set[asyncio.Task] = set()
 
-@router.websocket("/ws/chat/{room_id}")
-async def websocket_endpoint(
-    websocket: WebSocket,
-    room_id: int,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user_ws)
-):
-    # Accept the websocket connection
-    await websocket.accept()
+
+def schedule_eviction(websocket: WebSocket):
+    task = asyncio.create_task(evict_connection(websocket))
+    _eviction_tasks.add(task)
+    task.add_done_callback(_eviction_tasks.discard)
+
+
+manager = ConnectionManager(
+    max_durable=settings.ws_outbox_max_durable,
+    shed_threshold=settings.ws_outbox_shed_threshold,
+    max_typing=settings.ws_typing_max_users,
+    on_connection_lost=schedule_eviction,
+)
+flood_control = FloodControl(
+    connection_budgets={
+        "message": (settings.ws_message_rate, settings.ws_message_burst),
+        "typing": (settings.ws_typing_rate, settings.ws_typing_burst),
+        "seen": (settings.ws_seen_rate, settings.ws_seen_burst),
+        "history": (settings.ws_history_rate, settings.ws_history_burst),
+    },
+    room_budgets={
+        "message": (settings.ws_room_message_rate, settings.ws_room_message_burst),
+        "typing": (settings.ws_room_typing_rate, settings.ws_room_typing_burst),
+        "seen": (settings.ws_room_seen_rate, settings.ws_room_seen_burst),
+    },
+)
+
+admission = AdmissionController(
+    max_inflight=settings.ws_join_max_inflight,
+    max_queued=settings.ws_join_max_queued,
+    queue_timeout=settings.ws_join_queue_timeout,
+    retry_after=settings.ws_join_retry_after,
+    retry_jitter=settings.ws_join_retry_jitter,
+)
+
+# Events that are silently dropped when throttled; anything else gets an error frame
+EPHEMERAL_EVENTS = {"typing", "seen"}
+# Client event types the endpoint handles; frames of any other type are ignored
+HANDLED_EVENTS = {"message", "typing", "history", "seen"}
+
+
+async def evict_connection(websocket: WebSocket):
+    """Drop a connection that stopped answering pings, as if it had disconnected."""
+    for room_id, user in manager.connections_of(websocket):
+        await handle_disconnect(websocket, room_id, user)
+    try:
+        await websocket.close(code=status.WS_1001_GOING_AWAY)
+    except Exception:
+        pass  # half-open socket; the receive loop ends when the transport gives up
+
+
+heartbeat = HeartbeatMonitor(
+    interval=settings.ws_heartbeat_interval,
+    timeout=settings.ws_heartbeat_timeout,
+    tick=settings.ws_heartbeat_tick,
+    on_ping=lambda ws: manager.send(ws, {"type": "ping"}),
+    on_evict=schedule_eviction,
+)
+
+
+@router.get("/ws/stats")
+def websocket_stats(current_user: User = Depends(get_current_user)):
+    """Admission, throttling, delivery and heartbeat counters for the WebSocket endpoint."""
+    return {
+        "admission": admission.get_stats(),
+        "flood_control": flood_control.stats(),
+        "delivery": manager.stats(),
+        "heartbeat": heartbeat.get_stats(),
+    }
+
+
+def push_unread(user_id: int, room_id: int):
+    """Tell every open connection of a user about its new unread count for a room."""
+    manager.send_to_user(user_id, {
+        "type": "unread_update",
+        "room_id": room_id,
+        "count": unread_counters.get(user_id, room_id),
+    })
+
+
+async def publish_chat_message(room_id: int, message_payload: dict, members: set[int]):
+    """Broadcast a new chat message and update unread badges of members not looking at the room."""
+    await manager.broadcast(
+        room_id,
+        {
+            "type": "chat_message",
+            "room_id": room_id,
+            **message_payload,
+        },
+    )
+
+    in_room = manager.connected_user_ids(room_id)
+    for user_id in members:
+        if user_id not in in_room:
+            push_unread(user_id, room_id)
+
+
+async def join_room_connection(websocket: WebSocket, room_id: int) -> Connection | None:
+    """
+    Authenticate, check membership, register and announce a new connection.
+    Returns the registered Connection; the ORM User is not kept past the join.
+    """
+    try:
+        current_user = await get_current_user_ws(websocket)
+    except HTTPException:
+        return None  # get_current_user_ws already closed the socket
 
     # Check if user is a member of this room
-    if not is_user_member(current_user.id, room_id, session):
+    with Session(engine) as session:
+        is_member = is_user_member(current_user.id, room_id, session)
+    if not is_member:
         await websocket.send_json({
             "type": "error",
             "message": "You are not a member of this room."
         })
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-        return
+        return None
 
     # Register connection (room + user)
-    await manager.connect(websocket, room_id, current_user)
-    await manager.broadcast_online_status(room_id)
+    conn = await manager.connect(websocket, room_id, current_user)
+    current_user = conn.user
+    heartbeat.register(websocket)
 
-    # Send recent chat history to the newly joined user
-    messages = get_room_messages(room_id, current_user, session)
-    await websocket.send_json(
-        {
-            "type": "history",
-            "messages": [
-                {
-                    "id": m.id,
-                    "sender": m.sender.username,
-                    "content": m.content,
-                    "timestamp": m.timestamp.isoformat(),
-                }
-                for m in messages
-            ],
-        }
-    )
+    # Send the newest page of chat history to the newly joined user
+    with Session(engine) as session:
+        messages = read_history(room_id, session, limit=settings.history_page_size)  # membership checked above
+        read_changed = bool(messages) and unread_counters.mark_read(current_user.id, room_id, messages[-1]["id"], session)
+        anchor = history_pages.anchor(room_id, session)
+    # Older pages are fetched over HTTP, starting at the page before the open one
+    older_url = history_page_url(room_id, anchor) if anchor else None
+    manager.send(websocket, {"type": "history", "messages": messages, "older_url": older_url})
+    if read_changed:
+        push_unread(current_user.id, room_id)
 
-    # Broadcast "user joined"
-    await manager.broadcast(
-        room_id,
-        {
-            "type": "system",
-            "room_id": room_id,
-            "message": f"{current_user.username} joined the room.",
-            "timestamp": datetime.utcnow().isoformat()
-        }
-    )
+    # Broadcast presence and "user joined" (batched per room during a reconnect storm)
+    batch_window = settings.ws_join_batch_window if admission.storm else None
+    await manager.announce_join(room_id, current_user.username, batch_window)
+    return conn
+
+
+@router.websocket("/ws/chat/{room_id}")
+async def websocket_endpoint(websocket: WebSocket, room_id: int):
+    # Every DB access below uses its own short session, so an open socket holds
+    # no pooled connection and no identity map between events.
+
+    # Accept the websocket connection
+    await websocket.accept()
+
+    # Bound concurrent joins; past the queue, tell the client when to come back
+    if not await admission.acquire():
+        await websocket.send_json({
+            "type": "retry",
+            "retry_after_ms": int(admission.retry_after() * 1000),
+        })
+        await websocket.close(code=1013)  # try again later
+        return
+    try:
+        with track_queries("WS join"):
+            conn = await join_room_connection(websocket, room_id)
+    finally:
+        admission.release()
+    if conn is None:
+        return
+    current_user = conn.user
 
     try:
         while True:
             data = await websocket.receive_json()
+            heartbeat.touch(websocket)
 
-            # 🟢 Handle normal chat message
-            if "content" in data:
-                content = data["content"]
-                temp_id = data.get("tempId")
+            if data.get("type") == "pong":
+                continue
 
-                if not content:
-                    continue
+            event_type = "message" if "content" in data else data.get("type")
+            if event_type not in HANDLED_EVENTS:
+                continue  # don't let arbitrary type names into the counters or query stats
+            # A throttled "stop" would leave the indicator on for everyone; only "start" is budgeted
+            typing_stop = event_type == "typing" and data.get("status") != "start"
+            if not typing_stop and not flood_control.allow(conn.conn_id, room_id, event_type):
+                if event_type not in EPHEMERAL_EVENTS:
+                    manager.send(websocket, {
+                        "type": "error",
+                        "code": "rate_limited",
+                        "message": "You're sending too fast. Please slow down.",
+                        "retry_after": round(flood_control.retry_after(conn.conn_id, room_id, event_type), 2),
+                        "tempId": data.get("tempId"),
+                    })
+                continue
 
-                # Save message in DB
-                msg = send_message(room_id, content, current_user, session)
+            with track_queries(f"WS {event_type}"):
+                # 🟢 Handle normal chat message
+                if "content" in data:
+                    content = data["content"]
+                    temp_id = data.get("tempId")
 
-                message_payload = {
-                    "type": "chat_message",
-                    "id": msg.id,
-                    "sender": current_user.username,
-                    "content": msg.content,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
+                    if not content:
+                        continue
 
-                # Echo back with tempId for sender only
-                await websocket.send_json({**message_payload, "tempId": temp_id})
+                    # Save message in DB
+                    with Session(engine) as session:
+                        msg = send_message(room_id, content, current_user, session)
+                        members = unread_counters.members(room_id, session)
 
-                # Broadcast to everyone in the room
-                await manager.broadcast(
-                    room_id,
-                    {
+                    message_payload = {
                         "type": "chat_message",
-                        "room_id": room_id,
-                        **message_payload,
-                    },
-                )
-                continue
+                        "id": msg.id,
+                        "sender": current_user.username,
+                        "content": msg.content,
+                        "timestamp": msg.timestamp.isoformat(),
+                        "attachment": None,
+                    }
 
-            # --- typing start/stop ---
-            elif data.get("type") == "typing":
-                status_flag = data.get("status")  # "start" or "stop"
-                manager.set_typing(room_id, current_user.id, status_flag == "start")
-                # broadcast full list of typing usernames
-                await manager.broadcast(room_id, {
-                    "type": "typing_update",
-                    "room_id": room_id,
-                    "users": manager.list_typing_usernames(room_id)
-                })
-                continue
+                    # Echo back with tempId for sender only
+                    manager.send(websocket, {**message_payload, "tempId": temp_id})
+
+                    # Broadcast to everyone in the room
+                    await publish_chat_message(room_id, message_payload, members)
+                    continue
+
+                # --- typing start/stop ---
+                elif data.get("type") == "typing":
+                    status_flag = data.get("status")  # "start" or "stop"
+                    if not manager.set_typing(room_id, current_user.id, status_flag == "start"):
+                        continue  # repeated start/stop: nothing to tell the room
+                    # broadcast full list of typing usernames
+                    await manager.broadcast(room_id, {
+                        "type": "typing_update",
+                        "room_id": room_id,
+                        "users": manager.list_typing_usernames(room_id)
+                    })
+                    continue
 
-            # 🟢 Handle seen event
-            elif data.get("type") == "seen":
-                message_id = data.get("message_id")
+                # --- older history page (scrollback) ---
+                elif data.get("type") == "history":
+                    before_id = data.get("before_id")
+                    with Session(engine) as session:
+                        messages = get_room_history(
+                            room_id, current_user, session, before_id=before_id, limit=settings.history_page_size
+                        )
+                    manager.send(websocket, {
+                        "type": "history_page",
+                        "messages": messages,
+                        "has_more": len(messages) == settings.history_page_size,
+                    })
+                    continue
 
-                # Store in DB (only if not already stored)
-                seen_entry = mark_message_seen(message_id, current_user.id, session)
-                if not seen_entry:
-                    continue  # Already seen, nothing to do
+                # 🟢 Handle seen event
+                elif data.get("type") == "seen":
+                    message_id = data.get("message_id")
 
-                # Find sender and notify them only
-                message = session.get(Message, message_id)
-                if message and message.sender_id != current_user.id:
-                    sender_ws = manager.get_user_ws(room_id, message.sender_id)
-                    if sender_ws:
-                        await sender_ws.send_json({
-                            "type": "seen_update",
-                            "message_id": message_id,
-                            "seen_by": current_user.username,
-                            "seen_at": seen_entry.seen_at.isoformat()
-                        })
+                    with Session(engine) as session:
+                        # Store in DB (only if not already stored)
+                        seen_entry = mark_message_seen(message_id, current_user.id, session)
+                        if not seen_entry:
+                            continue  # Already seen, nothing to do
 
+                        # Find sender and notify them only
+                        message = session.get(Message, message_id)
+                        read_changed = (
+                            message is not None
+                            and message.room_id == room_id
+                            and unread_counters.mark_read(current_user.id, room_id, message_id, session)
+                        )
+                        # Read everything the notification needs while the session is open
+                        sender_id = message.sender_id if message else None
+                        seen_at = seen_entry.seen_at.isoformat()
+                    if read_changed:
+                        push_unread(current_user.id, room_id)
+                    if sender_id is not None and sender_id != current_user.id:
+                        sender_ws = manager.get_user_ws(room_id, sender_id)
+                        if sender_ws:
+                            manager.send(sender_ws, {
+                                "type": "seen_update",
+                                "message_id": message_id,
+                                "seen_by": current_user.username,
+                                "seen_at": seen_at
+                            })
 
     except WebSocketDisconnect:
-        # Cleanup connection
-        manager.disconnect(websocket, room_id, current_user)
-        # clear typing and notify others
-        await manager.broadcast(room_id, {
-            "type": "typing_update",
+        await handle_disconnect(websocket, room_id, current_user)
+
+
+async def handle_disconnect(websocket: WebSocket, room_id: int, user: UserRef):
+    """Cleanup after a client left or was evicted. Safe to call twice."""
+    heartbeat.unregister(websocket)
+    conn = manager.connections.get(websocket)
+    if conn is not None:
+        flood_control.forget_connection(conn.conn_id)
+    if not manager.disconnect(websocket, room_id, user):
+        return
+    if room_id not in manager.active_connections:
+        flood_control.forget_room(room_id)
+    # clear typing and notify others
+    await manager.broadcast(room_id, {
+        "type": "typing_update",
+        "room_id": room_id,
+        "users": manager.list_typing_usernames(room_id)
+    })
+    await manager.broadcast_online_status(room_id)
+    # Broadcast "user left"
+    await manager.broadcast(
+        room_id,
+        {
+            "type": "system",
             "room_id": room_id,
-            "users": manager.list_typing_usernames(room_id)
-        })
-        await manager.broadcast_online_status(room_id)
-        # Broadcast "user left"
-        await manager.broadcast(
-            room_id,
-            {
-                "type": "system",
-                "room_id": room_id,
-                "message": f"{current_user.username} left the room.",
-                "timestamp": datetime.utcnow().isoformat()
-            }
-        )
\ No newline at end of file
+            "message": f"{user.username} left the room.",
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    )
\ No newline at end of file
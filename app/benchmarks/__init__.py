@@ -0,0 +1,77 @@
+# app/benchmarks/__init__.py
+"""
+Benchmarks run as `python -m app.cli bench-<name>`, against a throwaway database
+and data directories set up by the CLI (see `cmd_query_budget` for the pattern).
+Each returns a plain, key-sorted report that the CLI prints and writes as JSON.
+"""
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable
+
+from sqlalchemy import insert
+from sqlmodel import Session
+
+
+def timed(fn: Callable[[], object], repeat: int) -> dict:
+    """Call `fn` `repeat` times; median and p95 wall time in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def seed(
+    session: Session,
+    usernames: list[str],
+    room_names: list[str],
+    members: Iterable[tuple[int, int]] | None = None,
+) -> dict:
+    """
+    Insert users and rooms; `members` holds (user index, room index) pairs and
+    defaults to everyone in every room. Users get no usable password (harnesses
+    log in with `access_token`). Returns their ids in the order given.
+    """
+    from app.db.models import ChatRoom, User, UserChatRoom
+    from app.utils.auth import UNUSABLE_PASSWORD
+
+    now = datetime.utcnow()
+    user_ids = session.execute(
+        insert(User).returning(User.id, sort_by_parameter_order=True),
+        [
+            {"username": name, "email": f"{name}@bench.invalid", "hashed_password": UNUSABLE_PASSWORD, "created_at": now, "is_verified": True}
+            for name in usernames
+        ],
+    ).scalars().all()
+    room_ids = session.execute(
+        insert(ChatRoom).returning(ChatRoom.id, sort_by_parameter_order=True),
+        [{"name": name} for name in room_names],
+    ).scalars().all()
+    if members is None:
+        members = [(u, r) for u in range(len(user_ids)) for r in range(len(room_ids))]
+    links = [{"user_id": user_ids[u], "room_id": room_ids[r]} for u, r in members]
+    if links:
+        session.execute(insert(UserChatRoom), links)
+    session.commit()
+    return {"user_ids": list(user_ids), "room_ids": list(room_ids)}
+
+
+def access_token(user_id: int) -> str:
+    """A session cookie value for `user_id`, valid for an hour."""
+    from app.utils.auth import create_access_token
+
+    return create_access_token({"sub": str(user_id)}, timedelta(hours=1))
+
+
+def receive_until(ws, event_type: str) -> dict:
+    """Read WebSocket events until one of `event_type` arrives; return it."""
+    while True:
+        event = ws.receive_json()
+        if event.get("type") == event_type:
+            return event
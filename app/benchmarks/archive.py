@@ -0,0 +1,151 @@
+# app/benchmarks/archive.py
+"""
+Archive benchmark, run as `python -m app.cli bench-archive`.
+
+Seeds rooms whose history spans `SPAN_DAYS`, measures the database size and the
+latency of hot queries, runs the archive job and measures again. SQLite only
+returns freed pages to the filesystem on VACUUM, so the "after" size is taken
+after one; on Postgres the table sizes are reported (autovacuum reuses the space).
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+from sqlmodel import Session
+
+from app import benchmarks
+from app.benchmarks import timed
+
+SPAN_DAYS = 365
+SIZED_DIALECTS = ("sqlite", "postgresql")  # databases db_size knows how to measure
+
+
+def seed(session: Session, rooms: int, messages_per_room: int) -> dict:
+    """Messages evenly spread over the last SPAN_DAYS, interleaved across rooms like real traffic."""
+    from app.db.models import Message
+
+    ids = benchmarks.seed(session, ["bench"], [f"bench{i}" for i in range(rooms)])
+    user_id, room_ids = ids["user_ids"][0], ids["room_ids"]
+    now = datetime.utcnow()
+
+    step = timedelta(days=SPAN_DAYS) / messages_per_room
+    batch = []
+    for i in range(messages_per_room):
+        for room_id in room_ids:
+            batch.append({
+                "content": f"benchmark message {i} " + "lorem ipsum " * 8,
+                "sender_id": user_id,
+                "room_id": room_id,
+                "timestamp": now - (messages_per_room - i) * step,
+            })
+        if len(batch) >= 10_000:
+            session.execute(insert(Message), batch)
+            batch = []
+    if batch:
+        session.execute(insert(Message), batch)
+    session.commit()
+    return {"user_id": user_id, "room_ids": room_ids}
+
+
+def db_size(session: Session) -> int:
+    """Bytes used by the database (SQLite file) or the message tables (Postgres)."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        page_count = session.execute(text("PRAGMA page_count")).scalar()
+        page_size = session.execute(text("PRAGMA page_size")).scalar()
+        return page_count * page_size
+    if dialect == "postgresql":
+        return session.execute(text(
+            "SELECT pg_total_relation_size('messages') + pg_total_relation_size('message_seen')"
+        )).scalar()
+    raise ValueError(f"db_size: can't measure a {dialect} database")
+
+
+def vacuum(engine):
+    """Give SQLite's free pages back to the filesystem (VACUUM can't run inside a transaction)."""
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+
+
+def archive_size() -> int:
+    from app.core.config import settings
+
+    total = 0
+    for root, _, files in os.walk(settings.archive_dir):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def hot_queries(session: Session, user_id: int, room_ids: list[int], repeat: int) -> dict:
+    """Latency of the queries every room open pays: newest history page and the full room listing."""
+    from app.db.models import User
+    from app.services.chat_service import get_room_messages, read_history
+    from app.services.history_service import history_pages
+
+    user = session.get(User, user_id)
+    room_ids = room_ids[:10]
+    results = {}
+    for name, fn in {
+        "newest_page": lambda room_id: read_history(room_id, session),
+        "room_messages": lambda room_id: get_room_messages(room_id, user, session),
+    }.items():
+        def run_all():
+            for room_id in room_ids:
+                fn(room_id)
+                session.expunge_all()  # measure the query, not identity map hits
+        per_round = timed(run_all, repeat)
+        results[name] = {k: round(v / len(room_ids), 3) for k, v in per_round.items()}  # per room
+    history_pages.rooms.clear()
+    return results
+
+
+def archived_page(session: Session, room_ids: list[int], repeat: int) -> dict:
+    """Latency of a scrollback page that has to come from the archive."""
+    from app.services import archive_service
+    from app.services.chat_service import read_history
+
+    room_id = room_ids[0]
+    segments = archive_service.get_segments(room_id)
+    if not segments:
+        return {}
+    before_id = (segments[0].first_id + segments[-1].last_id) // 2
+    return timed(lambda: read_history(room_id, session, before_id=before_id), repeat)
+
+
+def run(rooms: int, messages_per_room: int, repeat: int) -> dict:
+    from app.core.config import settings
+    from app.db.migrations import migrate
+    from app.db.session import engine
+    from app.services.archive_service import archive_old_messages
+
+    engine.echo = False
+    migrate(engine)
+    with Session(engine) as session:
+        ids = seed(session, rooms, messages_per_room)
+        vacuum(engine)
+        before = {
+            "db_bytes": db_size(session),
+            "archive_bytes": archive_size(),
+            "hot_queries": hot_queries(session, ids["user_id"], ids["room_ids"], repeat),
+        }
+        session.commit()
+
+        moved = archive_old_messages(session)
+        session.commit()  # release the read snapshot before VACUUM
+        vacuum(engine)
+        after = {
+            "db_bytes": db_size(session),
+            "archive_bytes": archive_size(),
+            "hot_queries": hot_queries(session, ids["user_id"], ids["room_ids"], repeat),
+            "archived_page": archived_page(session, ids["room_ids"], repeat),
+        }
+
+    total = rooms * messages_per_room
+    return {
+        "messages": total,
+        "archived": moved,
+        "archive_after_days": settings.archive_after_days,
+        "before": before,
+        "after": after,
+    }
@@ -0,0 +1,144 @@
+# app/benchmarks/attachments.py
+"""
+Attachment benchmark, run as `python -m app.cli bench-attachments`.
+
+Starts the app under uvicorn in a child process (TestClient would buffer
+whole bodies in this process) and streams uploads and downloads through it
+with httpx: upload and full-download throughput, ranged reads per second,
+and the server's peak RSS before and after. Streaming keeps the peak flat
+however large the file is. Peak RSS is read from /proc (Linux only).
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from sqlmodel import Session
+
+from app import benchmarks
+
+CHUNK = 1024 * 1024
+RANGE_BYTES = 256 * 1024
+RANGE_REQUESTS = 200
+
+
+def peak_rss(pid: int) -> int | None:
+    """High-water RSS of a process in bytes (VmHWM), None where /proc isn't available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(port: int, log_path: str) -> subprocess.Popen:
+    import httpx
+
+    with open(log_path, "wb") as log:  # the engine echoes every statement
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            env=os.environ.copy(),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/ws/stats", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"bench-attachments: server did not start, see {log_path}")
+
+
+def _body(size: int, seed: bytes):
+    """`size` bytes, unique per seed so every upload is a new blob (no dedup shortcut)."""
+    block = os.urandom(CHUNK)
+    yield seed
+    sent = len(seed)
+    while sent < size:
+        chunk = block[:size - sent]
+        sent += len(chunk)
+        yield chunk
+
+
+def _mib_per_s(size: int, seconds: float) -> float:
+    return round(size / 2**20 / seconds, 1)
+
+
+def run(size: int, uploads: int) -> dict:
+    import httpx
+    from app.core.config import settings
+    from app.db.migrations import migrate
+    from app.db.session import engine
+
+    engine.echo = False
+    migrate(engine)
+    with Session(engine) as session:
+        ids = benchmarks.seed(session, ["bench"], ["bench"])
+    room_id = ids["room_ids"][0]
+    token = benchmarks.access_token(ids["user_ids"][0])
+
+    port = _free_port()
+    server = _start_server(port, os.path.join(os.path.dirname(settings.attachments_dir), "server.log"))
+    try:
+        rss_idle = peak_rss(server.pid)
+        client = httpx.Client(base_url=f"http://127.0.0.1:{port}", cookies={"access_token": token}, timeout=300)
+        upload_rates, download_rates, urls = [], [], []
+
+        for i in range(uploads):
+            started = time.perf_counter()
+            response = client.post(
+                f"/chat/rooms/{room_id}/attachments",
+                params={"filename": f"bench-{i}.bin"},
+                content=_body(size, f"{i}:{time.time_ns()}".encode()),
+                headers={"content-type": "application/octet-stream", "content-length": str(size)},
+            )
+            response.raise_for_status()
+            upload_rates.append(_mib_per_s(size, time.perf_counter() - started))
+            urls.append(response.json()["attachment"]["url"])
+
+        for url in urls:
+            started = time.perf_counter()
+            received = 0
+            with client.stream("GET", url) as response:
+                response.raise_for_status()
+                for chunk in response.iter_raw(CHUNK):
+                    received += len(chunk)
+            assert received == size, f"{url}: got {received} of {size} bytes"
+            download_rates.append(_mib_per_s(size, time.perf_counter() - started))
+
+        started = time.perf_counter()
+        step = max(1, (size - RANGE_BYTES) // RANGE_REQUESTS)
+        for i in range(RANGE_REQUESTS):
+            start = (i * step) % max(1, size - RANGE_BYTES)
+            response = client.get(urls[0], headers={"range": f"bytes={start}-{start + RANGE_BYTES - 1}"})
+            assert response.status_code == 206, response.status_code
+        ranges_per_s = round(RANGE_REQUESTS / (time.perf_counter() - started), 1)
+
+        client.close()
+        rss_peak = peak_rss(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    return {
+        "file_bytes": size,
+        "uploads": uploads,
+        "upload_mib_per_s": upload_rates,
+        "download_mib_per_s": download_rates,
+        "range_requests_per_s": ranges_per_s,
+        "range_bytes": RANGE_BYTES,
+        "server_peak_rss_bytes": {"idle": rss_idle, "after": rss_peak},
+    }
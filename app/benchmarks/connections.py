@@ -0,0 +1,91 @@
+# app/benchmarks/connections.py
+"""
+Connection memory benchmark, run as `python -m app.cli bench-connections`.
+
+Registers idle connections with a ConnectionManager the way the WebSocket
+endpoint does (every socket brings its own freshly loaded User) and reports
+traced Python bytes per connection. With `--baseline REV` the same measurement
+also runs against the `app` package of an older commit (exported with
+`git archive`), which gives a before/after for changes to the manager.
+
+Each measurement runs in a fresh interpreter started on this file, with the
+tree under test first on sys.path, so both sides import only their own code.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# A realistic bcrypt hash: the old manager kept it on every connection
+HASHED_PASSWORD = "$2b$12$" + "x" * 53
+
+
+def measure(connections: int, users: int, rooms: int) -> dict:
+    """Bytes per idle connection in this interpreter (imports whatever `app` is on sys.path)."""
+    import asyncio
+    import gc
+    import tracemalloc
+
+    from app.db.models import User
+    from app.utils.connection_manager import ConnectionManager
+
+    class IdleWebSocket:
+        async def send_json(self, message):
+            pass
+
+        async def close(self, code=None):
+            pass
+
+    async def register() -> int:
+        manager = ConnectionManager()
+        sockets = [IdleWebSocket() for _ in range(connections)]
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for i, ws in enumerate(sockets):
+            user_id = i % users + 1
+            user = User(
+                id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                hashed_password=HASHED_PASSWORD,
+            )
+            await manager.connect(ws, i % rooms + 1, user)
+            del user  # only what the manager keeps should count
+        await asyncio.sleep(0)  # let any per-connection tasks start
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        return used
+
+    used = asyncio.run(register())
+    return {"connections": connections, "users": users, "rooms": rooms, "bytes_per_connection": round(used / connections)}
+
+
+def _measure_tree(root: str, connections: int, users: int, rooms: int) -> dict:
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), str(connections), str(users), str(rooms)],
+        cwd=root,
+        env={**os.environ, "PYTHONPATH": root},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def run(connections: int, users: int, rooms: int, baseline: str | None = None) -> dict:
+    repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    report = {"current": _measure_tree(repo_root, connections, users, rooms)}
+    if baseline:
+        with tempfile.TemporaryDirectory(prefix="bench-connections-") as tree:
+            archive = subprocess.run(
+                ["git", "archive", baseline, "app"], cwd=repo_root, capture_output=True, check=True
+            ).stdout
+            subprocess.run(["tar", "-x", "-C", tree], input=archive, check=True)
+            report["baseline"] = {"rev": baseline, **_measure_tree(tree, connections, users, rooms)}
+    return report
+
+
+if __name__ == "__main__":
+    # Child process entry point used by _measure_tree
+    print(json.dumps(measure(*(int(arg) for arg in sys.argv[1:4]))))
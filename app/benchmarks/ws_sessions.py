@@ -0,0 +1,121 @@
+# app/benchmarks/ws_sessions.py
+"""
+WebSocket session check, run as `python -m app.cli ws-sessions`.
+
+1. Opens IDLE_FACTOR times more sockets than the DB pool has slots (size +
+   overflow) and verifies none of them holds a pooled connection while idle,
+   and that a message still goes through.
+2. Runs a long chat session between two members (message, then "seen" from
+   the other side, per round) and samples traced Python memory along the way.
+   Every event uses its own short DB session, so memory must stay flat: growth
+   per event above MAX_GROWTH_PER_EVENT means something keeps per-event state
+   (an identity map, an unbounded queue) for the lifetime of a connection.
+
+Flood control is opened up by the CLI so the long session isn't throttled.
+"""
+import contextlib
+import gc
+import tracemalloc
+
+from sqlmodel import Session
+
+from app import benchmarks
+from app.benchmarks import access_token, receive_until
+
+IDLE_FACTOR = 10
+MAX_GROWTH_PER_EVENT = 64  # bytes
+WARMUP_ROUNDS = 50
+SAMPLES = 6
+
+
+def _round(alice, bob):
+    alice.send_json({"content": "hello", "tempId": "t"})
+    message = receive_until(bob, "chat_message")
+    receive_until(alice, "chat_message")
+    bob.send_json({"type": "seen", "message_id": message["id"]})
+    receive_until(alice, "seen_update")
+
+
+def _traced_bytes() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def idle_sockets(client, user_id: int, room_id: int) -> dict:
+    from app.db.session import engine
+
+    pool = engine.pool
+    slots = pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+    client.cookies.set("access_token", access_token(user_id))
+    with contextlib.ExitStack() as stack:
+        sockets = []
+        for _ in range(slots * IDLE_FACTOR):
+            ws = stack.enter_context(client.websocket_connect(f"/ws/chat/{room_id}"))
+            receive_until(ws, "history")
+            sockets.append(ws)
+        checked_out = pool.checkedout()
+        sockets[0].send_json({"content": "still here", "tempId": "t"})
+        receive_until(sockets[-1], "chat_message")
+    return {"pool_slots": slots, "idle_sockets": len(sockets), "checked_out_while_idle": checked_out}
+
+
+def long_session(client, alice_id: int, bob_id: int, room_id: int, rounds: int) -> dict:
+    client.cookies.set("access_token", access_token(alice_id))
+    with client.websocket_connect(f"/ws/chat/{room_id}") as alice:
+        receive_until(alice, "history")
+        client.cookies.set("access_token", access_token(bob_id))
+        with client.websocket_connect(f"/ws/chat/{room_id}") as bob:
+            receive_until(bob, "history")
+            for _ in range(WARMUP_ROUNDS):
+                _round(alice, bob)
+
+            tracemalloc.start()
+            try:
+                samples = [_traced_bytes()]
+                per_sample = max(1, rounds // SAMPLES)
+                for _ in range(SAMPLES):
+                    for _ in range(per_sample):
+                        _round(alice, bob)
+                    samples.append(_traced_bytes())
+            finally:
+                tracemalloc.stop()
+
+    # The first interval still fills one-off caches (compiled statements, pools);
+    # steady-state growth is measured from the end of it
+    events = 2 * per_sample * (SAMPLES - 1)  # one message and one "seen" per round
+    growth = samples[-1] - samples[1]
+    return {
+        "events": events,
+        "traced_bytes": samples,
+        "growth_bytes": growth,
+        "growth_bytes_per_event": round(growth / events, 2),
+    }
+
+
+def run(rounds: int) -> dict:
+    from fastapi.testclient import TestClient
+    from app.db.migrations import migrate
+    from app.db.session import engine
+    from app.main import app
+
+    engine.echo = False
+    migrate(engine)
+    with Session(engine) as session:
+        ids = benchmarks.seed(session, ["idle", "alice", "bob"], ["idle", "session"], members=[(0, 0), (1, 1), (2, 1)])
+
+    idle_id, alice_id, bob_id = ids["user_ids"]
+    with TestClient(app) as client:
+        report = {"idle": idle_sockets(client, idle_id, ids["room_ids"][0])}
+        report["session"] = long_session(client, alice_id, bob_id, ids["room_ids"][1], rounds)
+    return report
+
+
+def check(report: dict) -> list[str]:
+    problems = []
+    idle = report["idle"]
+    if idle["checked_out_while_idle"]:
+        problems.append(f"{idle['checked_out_while_idle']} pooled connections held by {idle['idle_sockets']} idle sockets")
+    growth = report["session"]["growth_bytes_per_event"]
+    if growth > MAX_GROWTH_PER_EVENT:
+        problems.append(f"memory grows {growth} bytes per event (limit {MAX_GROWTH_PER_EVENT})")
+    return problems
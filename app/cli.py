@@ -0,0 +1,218 @@
+# app/cli.py
+"""
+Maintenance commands, run as `python -m app.cli <command>`.
+
+    archive [--days N]   move messages older than N days into archive segments
+    compact              merge each room's archive segments into one
+    migrate [--status]   apply pending schema migrations (or just list them)
+    query-budget         count SQL per route against a seeded database; exit 1 over budget
+    bench-archive        DB size and hot-query latency before and after archiving
+    bench-attachments    upload/download throughput and server peak RSS
+    bench-connections    bytes per idle WebSocket connection (optionally vs. an older commit)
+    ws-sessions          idle sockets hold no DB connection, memory stays flat; exit 1 otherwise
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+
+
+def cmd_archive(args):
+    from sqlmodel import Session
+    from app.db.session import engine
+    from app.services.archive_service import archive_old_messages
+
+    with Session(engine) as session:
+        moved = archive_old_messages(session, older_than_days=args.days)
+    print(f"Archived {moved} messages")
+
+
+def cmd_compact(args):
+    from app.services.archive_service import compact_archive
+
+    print(f"Compacted {compact_archive()} rooms")
+
+
+def cmd_migrate(args):
+    from app.db.migrations import SCHEMA_VERSION, current_version, migrate, pending_migrations
+    from app.db.session import engine
+
+    engine.echo = False
+    if args.status:
+        print(f"Schema version {current_version(engine)}, code expects {SCHEMA_VERSION}")
+        for m in pending_migrations(engine):
+            print(f"  pending: {m.version} {m.name}")
+        return
+    applied = migrate(engine)
+    print(f"Applied {len(applied)} migrations, schema version {current_version(engine)}")
+
+
+def _scratch_environment(prefix: str, database_url: str | None) -> str:
+    """Point the app at a throwaway database and data dirs. Must run before app modules read the settings."""
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{os.path.join(workdir, 'scratch.db')}"
+    os.environ["ARCHIVE_DIR"] = os.path.join(workdir, "archive")
+    os.environ["ATTACHMENTS_DIR"] = os.path.join(workdir, "attachments")
+    return workdir
+
+
+def _write_report(report: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Report written to {path}")
+
+
+def cmd_query_budget(args):
+    _scratch_environment("query-budget-", args.database_url)
+    os.environ["QUERY_STATS_ENABLED"] = "true"
+    from app.query_budget import QUERY_BUDGETS, check, run
+
+    report = run()
+    for label, entry in report.items():
+        budget = QUERY_BUDGETS.get(label, "-")
+        print(f"{label:45} {entry['max_queries']:>4} / {budget:<4} {entry['calls']:>4} calls {entry['ms']:>9.2f} ms")
+    _write_report(report, args.report)
+
+    problems = check(report)
+    for problem in problems:
+        print(f"OVER BUDGET: {problem}", file=sys.stderr)
+    if problems:
+        sys.exit(1)
+
+
+def cmd_bench_archive(args):
+    _scratch_environment("bench-archive-", args.database_url)
+    from sqlalchemy.engine import make_url
+    from app.benchmarks.archive import SIZED_DIALECTS, run
+
+    # Checked before connecting: no point seeding a database whose size can't be read
+    dialect = make_url(os.environ["DATABASE_URL"]).get_backend_name()
+    if dialect not in SIZED_DIALECTS:
+        print(f"bench-archive: can't measure the size of a {dialect} database "
+              f"(supported: {', '.join(SIZED_DIALECTS)})", file=sys.stderr)
+        sys.exit(2)
+
+    report = run(args.rooms, args.messages, args.repeat)
+    print(f"{report['archived']} of {report['messages']} messages archived (older than {report['archive_after_days']} days)")
+    for phase in ("before", "after"):
+        entry = report[phase]
+        print(f"{phase:6} db {entry['db_bytes'] / 2**20:9.2f} MiB   archive {entry['archive_bytes'] / 2**20:9.2f} MiB")
+        for name, latency in entry["hot_queries"].items():
+            print(f"       {name:15} median {latency['median_ms']:8.3f} ms   p95 {latency['p95_ms']:8.3f} ms")
+    if report["after"]["archived_page"]:
+        latency = report["after"]["archived_page"]
+        print(f"       {'archived_page':15} median {latency['median_ms']:8.3f} ms   p95 {latency['p95_ms']:8.3f} ms")
+    _write_report(report, args.report)
+
+
+def cmd_bench_attachments(args):
+    _scratch_environment("bench-attachments-", args.database_url)
+    size = args.size_mib * 2**20
+    os.environ["ATTACHMENT_MAX_BYTES"] = str(size)
+    from app.benchmarks.attachments import run
+
+    report = run(size, args.uploads)
+    print(f"{report['uploads']} x {args.size_mib} MiB")
+    print(f"upload    {report['upload_mib_per_s']} MiB/s")
+    print(f"download  {report['download_mib_per_s']} MiB/s")
+    print(f"ranges    {report['range_requests_per_s']} req/s ({report['range_bytes'] // 1024} KiB each)")
+    rss = report["server_peak_rss_bytes"]
+    if rss["idle"] is not None:
+        print(f"server peak RSS {rss['idle'] / 2**20:.1f} MiB idle, {rss['after'] / 2**20:.1f} MiB after")
+    _write_report(report, args.report)
+
+
+def cmd_bench_connections(args):
+    from app.benchmarks.connections import run
+
+    report = run(args.connections, args.users, args.rooms, args.baseline)
+    current = report["current"]
+    print(f"{current['connections']} idle connections, {current['users']} users, {current['rooms']} rooms")
+    if "baseline" in report:
+        print(f"{report['baseline']['rev']:>12}: {report['baseline']['bytes_per_connection']} bytes per connection")
+    print(f"{'current':>12}: {current['bytes_per_connection']} bytes per connection")
+    _write_report(report, args.report)
+
+
+def cmd_ws_sessions(args):
+    _scratch_environment("ws-sessions-", args.database_url)
+    for event in ("MESSAGE", "SEEN"):
+        for scope in ("WS", "WS_ROOM"):
+            os.environ[f"{scope}_{event}_RATE"] = "1000000"
+            os.environ[f"{scope}_{event}_BURST"] = "1000000"
+    from app.benchmarks.ws_sessions import check, run
+
+    report = run(args.rounds)
+    idle, session = report["idle"], report["session"]
+    print(f"{idle['idle_sockets']} idle sockets, {idle['pool_slots']} pool slots: "
+          f"{idle['checked_out_while_idle']} connections checked out")
+    print(f"{session['events']} events in one session: {session['growth_bytes']} bytes traced growth "
+          f"({session['growth_bytes_per_event']} bytes/event)")
+    _write_report(report, args.report)
+
+    problems = check(report)
+    for problem in problems:
+        print(f"FAILED: {problem}", file=sys.stderr)
+    if problems:
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive = subparsers.add_parser("archive", help="Move cold messages into the archive")
+    archive.add_argument("--days", type=int, default=None, help="Override settings.archive_after_days")
+    archive.set_defaults(func=cmd_archive)
+
+    compact = subparsers.add_parser("compact", help="Merge archive segments per room")
+    compact.set_defaults(func=cmd_compact)
+
+    migrate = subparsers.add_parser("migrate", help="Apply pending schema migrations")
+    migrate.add_argument("--status", action="store_true", help="Only show the current version and pending migrations")
+    migrate.set_defaults(func=cmd_migrate)
+
+    budget = subparsers.add_parser("query-budget", help="Check per-route SQL query budgets")
+    budget.add_argument("--report", default="query_report.json", help="Where to write the per-route report")
+    budget.add_argument("--database-url", default=None, help="Seed this (empty) database instead of a temporary SQLite file")
+    budget.set_defaults(func=cmd_query_budget)
+
+    bench_archive = subparsers.add_parser("bench-archive", help="Benchmark DB size and hot queries around archiving")
+    bench_archive.add_argument("--rooms", type=int, default=20)
+    bench_archive.add_argument("--messages", type=int, default=5000, help="Messages per room")
+    bench_archive.add_argument("--repeat", type=int, default=20, help="Timed rounds per query")
+    bench_archive.add_argument("--report", default="bench_archive.json")
+    bench_archive.add_argument("--database-url", default=None, help="Seed this (empty) database instead of a temporary SQLite file")
+    bench_archive.set_defaults(func=cmd_bench_archive)
+
+    bench_attachments = subparsers.add_parser("bench-attachments", help="Benchmark attachment upload/download")
+    bench_attachments.add_argument("--size-mib", type=int, default=128, help="Size of each uploaded file")
+    bench_attachments.add_argument("--uploads", type=int, default=3)
+    bench_attachments.add_argument("--report", default="bench_attachments.json")
+    bench_attachments.add_argument("--database-url", default=None, help="Seed this (empty) database instead of a temporary SQLite file")
+    bench_attachments.set_defaults(func=cmd_bench_attachments)
+
+    bench_connections = subparsers.add_parser("bench-connections", help="Benchmark memory per idle WebSocket connection")
+    bench_connections.add_argument("--connections", type=int, default=20000)
+    bench_connections.add_argument("--users", type=int, default=5000, help="Distinct users (several tabs each)")
+    bench_connections.add_argument("--rooms", type=int, default=500)
+    bench_connections.add_argument("--baseline", default=None, help="Also measure the app package of this git revision")
+    bench_connections.add_argument("--report", default="bench_connections.json")
+    bench_connections.set_defaults(func=cmd_bench_connections)
+
+    ws_sessions = subparsers.add_parser("ws-sessions", help="Check DB pool use and memory of long-lived WebSockets")
+    ws_sessions.add_argument("--rounds", type=int, default=1000, help="Message + seen rounds in the long session")
+    ws_sessions.add_argument("--report", default="bench_ws_sessions.json")
+    ws_sessions.add_argument("--database-url", default=None, help="Seed this (empty) database instead of a temporary SQLite file")
+    ws_sessions.set_defaults(func=cmd_ws_sessions)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ class Settings(BaseSettings):
     # Database & Auth
     # -----------------------------
     database_url: str
+    db_auto_migrate: bool = False   # apply pending migrations at startup (dev only)
     secret_key: str
     algorithm: str
     access_token_expire_minutes: int
@@ -25,6 +26,75 @@ class Settings(BaseSettings):
     email_from: str
     brevo_api_key: str | None = None
 
+    # -----------------------------
+    # Message history & archive
+    # -----------------------------
+    history_page_size: int = 50
+    history_cache_entries: int = 4096  # rendered closed history pages kept in memory
+    archive_dir: str = "data/archive"
+    archive_after_days: int = 90   # messages older than this move to the archive
+    archive_block_size: int = 256  # messages per compressed block in a segment
+
+    # -----------------------------
+    # WebSocket flood control (events/sec, burst)
+    # -----------------------------
+    ws_message_rate: float = 5.0
+    ws_message_burst: int = 10
+    ws_typing_rate: float = 2.0
+    ws_typing_burst: int = 4
+    ws_seen_rate: float = 20.0
+    ws_seen_burst: int = 60
+    ws_history_rate: float = 2.0
+    ws_history_burst: int = 5
+    ws_room_message_rate: float = 50.0
+    ws_room_message_burst: int = 100
+    ws_room_typing_rate: float = 20.0
+    ws_room_typing_burst: int = 40
+    ws_room_seen_rate: float = 200.0
+    ws_room_seen_burst: int = 400
+
+    # -----------------------------
+    # WebSocket delivery
+    # -----------------------------
+    ws_outbox_shed_threshold: int = 100  # queued durable events before ephemeral ones are shed
+    ws_outbox_max_durable: int = 1000    # queued durable events before the connection is dropped
+    ws_heartbeat_interval: float = 25.0  # idle seconds before the server pings
+    ws_heartbeat_timeout: float = 10.0   # seconds to wait for the pong before evicting
+    ws_heartbeat_tick: float = 1.0       # timing wheel resolution
+    ws_typing_max_users: int = 20        # typing indicator entries kept per room
+
+    # -----------------------------
+    # WebSocket admission control (reconnect storms)
+    # -----------------------------
+    ws_join_max_inflight: int = 32       # joins processed concurrently
+    ws_join_max_queued: int = 512        # joins waiting for a slot before we answer "retry"
+    ws_join_queue_timeout: float = 5.0
+    ws_join_retry_after: float = 2.0     # base retry hint in seconds, grows with the backlog
+    ws_join_retry_jitter: float = 3.0    # random seconds added to each retry hint
+    ws_join_batch_window: float = 0.5    # during a storm, coalesce join announcements per room
+
+    # -----------------------------
+    # Unread counters
+    # -----------------------------
+    unread_snapshot_seconds: int = 30
+
+    # -----------------------------
+    # History export / import
+    # -----------------------------
+    export_batch_size: int = 1000   # rows fetched per server-side cursor round trip
+    import_batch_size: int = 5000   # rows per executemany transaction
+
+    # -----------------------------
+    # Attachments
+    # -----------------------------
+    attachments_dir: str = "data/attachments"
+    attachment_max_bytes: int = 25 * 1024 * 1024
+
+    # -----------------------------
+    # SQL accounting (query budgets)
+    # -----------------------------
+    query_stats_enabled: bool = False   # count/time SQL per route and WebSocket event
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,293 @@
+# app/db/migrations.py
+"""
+Versioned schema migrations, run with `python -m app.cli migrate`.
+
+Each migration is a function registered with `@migration(version, name)`. The
+versions that have been applied are recorded in `schema_version`. Every
+migration is idempotent, so a fresh database and a database that predates this
+module (created by `create_all` at startup) end up in the same state. The first
+migration pins the tables as they were when this module was introduced, with
+its own table definitions: later changes to the models never change what it
+creates, and every schema change after it is a numbered migration of its own.
+
+Indexes are built online where the backend supports it. On Postgres they use
+CREATE INDEX CONCURRENTLY outside a transaction, so writes keep flowing. On
+SQLite there is no concurrent build: the index is created in one short write
+transaction while WAL readers carry on. At startup the app only compares the
+recorded version with SCHEMA_VERSION (see `check_schema`) and never reflects
+or creates tables itself.
+"""
+import logging
+import time
+from typing import Callable
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData, PrimaryKeyConstraint, String, Table,
+    inspect, text,
+)
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+
+class Migration:
+    def __init__(self, version: int, name: str, upgrade: Callable[[Connection], None], transactional: bool):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+        self.transactional = transactional
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, name: str, transactional: bool = True):
+    """Register an upgrade step. Non-transactional steps run in autocommit mode."""
+    def register(upgrade: Callable[[Connection], None]):
+        assert not MIGRATIONS or MIGRATIONS[-1].version < version, "migrations must be declared in order"
+        MIGRATIONS.append(Migration(version, name, upgrade, transactional))
+        return upgrade
+    return register
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+# -----------------------------
+# Helpers
+# -----------------------------
+
+def _create_index(conn: Connection, name: str, table: str, columns: list[str], unique: bool = False):
+    """CREATE INDEX IF NOT EXISTS, concurrently on Postgres (needs an autocommit connection)."""
+    unique_sql = "UNIQUE " if unique else ""
+    cols = ", ".join(columns)
+    if conn.dialect.name == "postgresql":
+        # An interrupted concurrent build leaves an INVALID index behind; rebuild it
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({cols})"))
+    else:
+        conn.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+
+
+# -----------------------------
+# Migrations (append only; never edit one that has shipped)
+# -----------------------------
+
+# The schema `create_all` produced before migrations existed, frozen. Never edit:
+# databases at version 1 were created from exactly this.
+_baseline_metadata = MetaData()
+
+Table(
+    "users", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("username", String, nullable=False),
+    Column("email", String, nullable=False),
+    Column("hashed_password", String, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("is_verified", Boolean, nullable=False),
+    Index("ix_users_username", "username", unique=True),
+    Index("ix_users_email", "email", unique=True),
+)
+Table(
+    "chatrooms", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+)
+Table(
+    "user_chatrooms", _baseline_metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("room_id", Integer, ForeignKey("chatrooms.id"), nullable=False),
+    PrimaryKeyConstraint("user_id", "room_id"),
+)
+Table(
+    "attachments", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("sha256", String, nullable=False),
+    Column("size", Integer, nullable=False),
+    Column("content_type", String, nullable=False),
+    Column("filename", String, nullable=False),
+    Column("uploader_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("room_id", Integer, ForeignKey("chatrooms.id"), nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Index("ix_attachments_sha256", "sha256"),
+)
+Table(
+    "messages", _baseline_metadata,  # attachment_id arrives in migration 2
+    Column("id", Integer, primary_key=True),
+    Column("content", String, nullable=False),
+    Column("timestamp", DateTime, nullable=False),
+    Column("sender_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("room_id", Integer, ForeignKey("chatrooms.id"), nullable=False),
+)
+Table(
+    "message_seen", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("message_id", Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("seen_at", DateTime, nullable=False),
+)
+Table(
+    "room_read_state", _baseline_metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("room_id", Integer, ForeignKey("chatrooms.id"), nullable=False),
+    Column("unread_count", Integer, nullable=False),
+    Column("last_read_message_id", Integer, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+    PrimaryKeyConstraint("user_id", "room_id"),
+)
+
+
+@migration(1, "baseline tables")
+def _baseline(conn: Connection):
+    _baseline_metadata.create_all(conn)  # checkfirst: tables of an older create_all are kept
+
+
+@migration(2, "messages.attachment_id")
+def _message_attachment(conn: Connection):
+    columns = {c["name"] for c in inspect(conn).get_columns("messages")}
+    if "attachment_id" not in columns:
+        conn.execute(text("ALTER TABLE messages ADD COLUMN attachment_id INTEGER REFERENCES attachments (id)"))
+
+
+@migration(3, "message indexes by room", transactional=False)
+def _message_room_indexes(conn: Connection):
+    # History pages / scrollback (room_id, id) and the archive job's cutoff scan (room_id, timestamp)
+    _create_index(conn, "ix_messages_room_id_id", "messages", ["room_id", "id"])
+    _create_index(conn, "ix_messages_room_id_timestamp", "messages", ["room_id", "timestamp"])
+
+
+@migration(4, "room members index", transactional=False)
+def _room_members_index(conn: Connection):
+    # The primary key is (user_id, room_id); this serves room -> members
+    _create_index(conn, "ix_user_chatrooms_room_id_user_id", "user_chatrooms", ["room_id", "user_id"])
+
+
+@migration(5, "unique message_seen (message_id, user_id)", transactional=False)
+def _message_seen_unique(conn: Connection):
+    # Racing "seen" events could insert duplicates before this constraint existed
+    conn.execute(text(
+        "DELETE FROM message_seen WHERE id NOT IN "
+        "(SELECT MIN(id) FROM message_seen GROUP BY message_id, user_id)"
+    ))
+    _create_index(conn, "uq_message_seen_message_id_user_id", "message_seen", ["message_id", "user_id"], unique=True)
+
+
+@migration(6, "messages.id never reused")
+def _message_ids_monotonic(conn: Connection):
+    # Archiving deletes the newest rows of quiet rooms. A plain INTEGER PRIMARY KEY on
+    # SQLite then hands those ids out again, next to their archived copies. Rebuild
+    # the table with AUTOINCREMENT and start the sequence above every id ever used.
+    from app.services.archive_service import max_archived_id
+
+    if conn.dialect.name == "sqlite":
+        ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'")).scalar()
+        if "AUTOINCREMENT" not in ddl.upper():
+            # The app never enables PRAGMA foreign_keys, so message_seen rows survive the swap
+            conn.execute(text(
+                "CREATE TABLE messages_new ("
+                "id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
+                "content VARCHAR NOT NULL, "
+                "timestamp DATETIME NOT NULL, "
+                "sender_id INTEGER NOT NULL REFERENCES users (id), "
+                "room_id INTEGER NOT NULL REFERENCES chatrooms (id), "
+                "attachment_id INTEGER REFERENCES attachments (id))"
+            ))
+            columns = "id, content, timestamp, sender_id, room_id, attachment_id"
+            conn.execute(text(f"INSERT INTO messages_new ({columns}) SELECT {columns} FROM messages"))
+            conn.execute(text("DROP TABLE messages"))
+            conn.execute(text("ALTER TABLE messages_new RENAME TO messages"))
+            _create_index(conn, "ix_messages_room_id_id", "messages", ["room_id", "id"])
+            _create_index(conn, "ix_messages_room_id_timestamp", "messages", ["room_id", "timestamp"])
+
+    high_water = max(
+        max_archived_id(),
+        conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM messages")).scalar(),
+        conn.execute(text("SELECT COALESCE(MAX(last_read_message_id), 0) FROM room_read_state")).scalar(),
+    )
+    if not high_water:
+        return
+    if conn.dialect.name == "sqlite":
+        current = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'messages'")).scalar() or 0
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'messages'"))
+        conn.execute(
+            text("INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', :seq)"),
+            {"seq": max(current, high_water)},
+        )
+    elif conn.dialect.name == "postgresql":
+        # A sequence never goes back, but ids may already have been reused before this ran
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('messages', 'id'), "
+            "GREATEST(:seq, (SELECT last_value FROM messages_id_seq)))"
+        ), {"seq": high_water})
+
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+
+def _ensure_version_table(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+        ))
+
+
+def current_version(engine: Engine) -> int:
+    """Highest applied migration, 0 for a database that has never been migrated."""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_version"):
+            return 0
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def pending_migrations(engine: Engine) -> list[Migration]:
+    version = current_version(engine)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def migrate(engine: Engine) -> list[Migration]:
+    """Apply every pending migration in order. Returns the ones applied."""
+    _ensure_version_table(engine)
+    applied = []
+    for m in pending_migrations(engine):
+        started = time.perf_counter()
+        logger.info(f"migrate: applying {m.version} ({m.name})")
+        if m.transactional:
+            with engine.begin() as conn:
+                m.upgrade(conn)
+                _record(conn, m)
+        else:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                m.upgrade(conn)
+            with engine.begin() as conn:
+                _record(conn, m)
+        logger.info(f"migrate: {m.version} done in {time.perf_counter() - started:.2f}s")
+        applied.append(m)
+    return applied
+
+
+def _record(conn: Connection, m: Migration):
+    conn.execute(
+        text("INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, CURRENT_TIMESTAMP)"),
+        {"version": m.version, "name": m.name},
+    )
+
+
+def check_schema(engine: Engine):
+    """Startup guard: one cheap query instead of reflecting the whole metadata."""
+    version = current_version(engine)
+    if version < SCHEMA_VERSION:
+        raise SchemaOutOfDate(
+            f"Database schema is at version {version}, this code needs {SCHEMA_VERSION}. "
+            f"Run `python -m app.cli migrate`."
+        )
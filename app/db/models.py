@@ -1,3 +1,4 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
 from datetime import datetime
@@ -12,6 +13,7 @@ class UserCreate(SQLModel):
 
 class UserChatRoom(SQLModel, table=True):
     __tablename__ = "user_chatrooms"   # ✅ explicit
+    __table_args__ = (Index("ix_user_chatrooms_room_id_user_id", "room_id", "user_id"),)
     user_id: int = Field(foreign_key="users.id", primary_key=True)
     room_id: int = Field(foreign_key="chatrooms.id", primary_key=True)
 
@@ -41,24 +43,54 @@ class ChatRoom(SQLModel, table=True):
 
 class Message(SQLModel, table=True):
     __tablename__ = "messages"   # ✅ plural, explicit
+    __table_args__ = (
+        Index("ix_messages_room_id_id", "room_id", "id"),
+        Index("ix_messages_room_id_timestamp", "room_id", "timestamp"),
+        # Archived rows leave the table; their ids must never be handed out again
+        {"sqlite_autoincrement": True},
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     content: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
     sender_id: int = Field(foreign_key="users.id")
     room_id: int = Field(foreign_key="chatrooms.id")
+    attachment_id: Optional[int] = Field(default=None, foreign_key="attachments.id")
 
     sender: "User" = Relationship(back_populates="messages")
     room: "ChatRoom" = Relationship(back_populates="messages")
     seen_by: list["MessageSeen"] = Relationship(back_populates="message")
+    attachment: Optional["Attachment"] = Relationship()
+
+
+class Attachment(SQLModel, table=True):
+    __tablename__ = "attachments"   # file bytes live on disk, content-addressed by sha256
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sha256: str = Field(index=True)
+    size: int
+    content_type: str
+    filename: str
+    uploader_id: int = Field(foreign_key="users.id")
+    room_id: int = Field(foreign_key="chatrooms.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
 class MessageSeen(SQLModel, table=True):
     __tablename__ = "message_seen"   # ✅ explicit
+    __table_args__ = (Index("uq_message_seen_message_id_user_id", "message_id", "user_id", unique=True),)
     id: Optional[int] = Field(default=None, primary_key=True)
     message_id: int = Field(foreign_key="messages.id", ondelete="CASCADE")
     user_id: int = Field(foreign_key="users.id", ondelete="CASCADE")
     seen_at: datetime = Field(default_factory=datetime.utcnow)
 
     message: Optional["Message"] = Relationship(back_populates="seen_by")
-    user: Optional["User"] = Relationship()
\ No newline at end of file
+    user: Optional["User"] = Relationship()
+
+
+class RoomReadState(SQLModel, table=True):
+    __tablename__ = "room_read_state"   # periodic snapshot of unread_service counters
+    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    room_id: int = Field(foreign_key="chatrooms.id", primary_key=True)
+    unread_count: int = 0
+    last_read_message_id: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
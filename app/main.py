@@ -1,15 +1,19 @@
 from fastapi import FastAPI, Request
-from sqlmodel import SQLModel
+from sqlmodel import Session
 from app.db.session import engine
-from app.api import auth_htmx, chat_ws, chat_htmx
+from app.db.migrations import check_schema, migrate
+from app.api import auth_htmx, chat_ws, chat_htmx, chat_transfer, chat_attachments
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
-from fastapi.staticfiles import StaticFiles
+from app.utils.static_assets import HashedStaticFiles
 from app.db.models import *
 import os
+import asyncio
 import logging
 from app.api import auth_htmx
 from app.utils.templates import templates
+from app.services.unread_service import unread_counters, snapshot_loop
+from app.utils.query_stats import QueryStatsMiddleware, query_recorder
 
 
 app = FastAPI()
@@ -18,16 +22,40 @@ logging.basicConfig(level=logging.INFO)
 
 @app.on_event("startup")
 def on_startup():
-    SQLModel.metadata.create_all(engine)
+    if settings.db_auto_migrate:
+        migrate(engine)
+    else:
+        check_schema(engine)  # schema changes go through `python -m app.cli migrate`
+    with Session(engine) as session:
+        unread_counters.load(session)
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    app.state.unread_snapshot_task = asyncio.create_task(snapshot_loop())
+    app.state.heartbeat_task = asyncio.create_task(chat_ws.heartbeat.run())
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    app.state.unread_snapshot_task.cancel()
+    app.state.heartbeat_task.cancel()
+    chat_ws.manager.close()
+    with Session(engine) as session:
+        unread_counters.snapshot(session)
 
 # Routers
 app.include_router(auth_htmx.router)
 app.include_router(chat_ws.router)
 app.include_router(chat_htmx.router)
+app.include_router(chat_transfer.router)
+app.include_router(chat_attachments.router)
 
 # Static & templates
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
+static_files = HashedStaticFiles(directory=os.path.join(BASE_DIR, "static"))
+app.mount("/static", static_files, name="static")
+templates.env.globals["static_path"] = static_files.hashed_path
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,6 +65,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.query_stats_enabled:
+    query_recorder.install(engine)
+    app.add_middleware(QueryStatsMiddleware)
+
 
 # Entry point
 @app.get("/")
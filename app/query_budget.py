@@ -0,0 +1,186 @@
+# app/query_budget.py
+"""
+SQL query budgets, run as `python -m app.cli query-budget`.
+
+Seeds a throwaway database, drives every HTTP route and WebSocket event through
+the app with `settings.query_stats_enabled` on, and compares the worst-case
+statement count per call against QUERY_BUDGETS. Rendered-page caches are
+cleared before each request, so budgets cover the cold (rendering) path.
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlmodel import Session
+
+from app import benchmarks
+from app.benchmarks import access_token, receive_until
+
+# Max SQL statements for a single request / WebSocket event.
+# Raise a budget only together with the change that needs it.
+QUERY_BUDGETS: dict[str, int] = {
+    "GET /chat": 2,                                  # user, rooms+membership
+    "GET /chat/room-list": 2,
+    "GET /chat/rooms/{room_id}": 2,
+    "GET /chat/rooms/{room_id}/history": 4,          # user, membership, page anchor, page
+    "GET /chat/rooms/{room_id}/history/{before_id}": 3,
+    "POST /chat/rooms": 5,
+    "POST /chat/rooms/{room_id}/join": 5,
+    "POST /chat/rooms/{room_id}/leave": 5,
+    "GET /chat/rooms/{room_id}/export": 6,
+    "POST /chat/import": 7,                          # user; per batch: authors, placeholders + ids, rooms, members, messages
+    "POST /chat/rooms/{room_id}/attachments": 11,
+    "GET /chat/attachments/{attachment_id}": 3,
+    "WS join": 4,                                    # user, membership, history page, page anchor (first join)
+    "WS message": 4,
+    "WS typing": 0,
+    "WS history": 2,
+    "WS seen": 3,                                    # insert, message, seen_at refresh
+}
+
+SEED_USERS = 20
+SEED_ROOMS = 10
+SEED_MESSAGES_PER_ROOM = 200
+REPEAT = 3  # calls per scenario; budgets apply to the worst one
+
+
+def seed(session: Session) -> dict:
+    """Rooms with many distinct senders, so per-row lookups show up as N+1s."""
+    from app.db.models import Message
+
+    # Everyone but the last user is in every room; the last one joins/leaves
+    ids = benchmarks.seed(
+        session,
+        [f"user{i}" for i in range(SEED_USERS)],
+        [f"room{i}" for i in range(SEED_ROOMS)],
+        members=[(u, r) for u in range(SEED_USERS - 1) for r in range(SEED_ROOMS)],
+    )
+    user_ids, room_ids = ids["user_ids"], ids["room_ids"]
+    now = datetime.utcnow()
+    session.execute(insert(Message), [
+        {
+            "content": f"message {i}",
+            "sender_id": user_ids[i % (SEED_USERS - 1)],
+            "room_id": r,
+            "timestamp": now - timedelta(seconds=SEED_MESSAGES_PER_ROOM - i),
+        }
+        for r in room_ids
+        for i in range(SEED_MESSAGES_PER_ROOM)
+    ])
+    session.commit()
+    return ids
+
+
+def _run_http(client, user_id: int, outsider_id: int, room_ids: list[int]):
+    from app.api.chat_htmx import history_cache
+    from app.utils.http_cache import fragment_cache
+
+    def cold(method: str, url: str, **kwargs):
+        fragment_cache.clear()
+        history_cache.clear()
+        response = client.request(method, url, follow_redirects=False, **kwargs)
+        assert response.status_code < 400, f"{method} {url}: {response.status_code} {response.text[:200]}"
+        return response
+
+    client.cookies.set("access_token", access_token(user_id))
+    for room_id in room_ids[:REPEAT]:
+        cold("GET", "/chat")
+        cold("GET", "/chat/room-list")
+        cold("GET", f"/chat/rooms/{room_id}")
+        open_page = cold("GET", f"/chat/rooms/{room_id}/history").text
+        older_url = open_page.split('data-older-url="', 1)[1].split('"', 1)[0].replace("&amp;", "&")
+        cold("GET", older_url)
+        cold("POST", "/chat/rooms", data={"name": f"budget-{room_id}"})
+        exported = cold("GET", f"/chat/rooms/{room_id}/export").content
+        cold("POST", "/chat/import", content=exported)
+        uploaded = cold(
+            "POST", f"/chat/rooms/{room_id}/attachments",
+            params={"filename": "budget.bin"}, content=os.urandom(4096),
+        ).json()
+        cold("GET", uploaded["attachment"]["url"], headers={"range": "bytes=0-1023"})
+
+    client.cookies.set("access_token", access_token(outsider_id))
+    for room_id in room_ids[:REPEAT]:
+        cold("POST", f"/chat/rooms/{room_id}/join")
+        cold("POST", f"/chat/rooms/{room_id}/leave")
+
+
+def _run_ws(client, user_ids: list[int], room_ids: list[int]):
+    """
+    user0 talks to user1 in each room while user2 sits in another room, so every
+    fan-out path runs: typing and messages to others, unread pushes to an online
+    member elsewhere, and seen_update to an online sender.
+    """
+    def connect(user_id: int, room_id: int):
+        client.cookies.set("access_token", access_token(user_id))
+        ws = client.websocket_connect(f"/ws/chat/{room_id}")
+        ws.__enter__()
+        return ws
+
+    elsewhere = connect(user_ids[2], room_ids[-1])
+    receive_until(elsewhere, "history")
+    try:
+        for room_id in room_ids[:REPEAT]:
+            ws = connect(user_ids[0], room_id)
+            peer = connect(user_ids[1], room_id)
+            try:
+                history = receive_until(ws, "history")["messages"]
+                receive_until(peer, "history")
+                others = [m["id"] for m in history if m["sender"] != "user0"]
+
+                ws.send_json({"type": "typing", "status": "start"})
+                receive_until(peer, "typing_update")
+                ws.send_json({"content": "budget", "tempId": "t1"})
+                sent = receive_until(peer, "chat_message")
+                receive_until(elsewhere, "unread_update")
+                peer.send_json({"type": "seen", "message_id": sent["id"]})
+                # Round-trip on peer first: if its handler died, this raises instead of hanging
+                peer.send_json({"type": "history", "before_id": sent["id"]})
+                receive_until(peer, "history_page")
+                receive_until(ws, "seen_update")
+                ws.send_json({"type": "seen", "message_id": others[-1]})
+                ws.send_json({"type": "history", "before_id": history[0]["id"]})
+                receive_until(ws, "history_page")
+                ws.send_json({"type": "typing", "status": "stop"})
+                ws.send_json({"type": "history", "before_id": history[-1]["id"]})
+                receive_until(ws, "history_page")
+            finally:
+                peer.__exit__(None, None, None)
+                ws.__exit__(None, None, None)
+    finally:
+        elsewhere.__exit__(None, None, None)
+
+
+def run() -> dict:
+    """Seed, exercise every route and return the recorder's report."""
+    from fastapi.testclient import TestClient
+    from app.db.migrations import migrate
+    from app.db.session import engine
+    from app.main import app
+    from app.utils.query_stats import query_recorder
+
+    engine.echo = False
+    migrate(engine)
+    with Session(engine) as session:
+        ids = seed(session)
+
+    with TestClient(app) as client:
+        query_recorder.reset()  # drop startup work
+        user_id, outsider_id = ids["user_ids"][0], ids["user_ids"][-1]
+        _run_http(client, user_id, outsider_id, ids["room_ids"])
+        _run_ws(client, ids["user_ids"], ids["room_ids"])
+    return query_recorder.report()
+
+
+def check(report: dict, budgets: dict[str, int] = QUERY_BUDGETS) -> list[str]:
+    """Return a message per budget violation (over budget, or route never exercised)."""
+    problems = []
+    for label, budget in sorted(budgets.items()):
+        entry = report.get(label)
+        if entry is None:
+            problems.append(f"{label}: not exercised")
+        elif entry["max_queries"] > budget:
+            problems.append(f"{label}: {entry['max_queries']} queries > budget {budget}")
+    for label in sorted(set(report) - set(budgets)):
+        problems.append(f"{label}: no budget declared")
+    return problems
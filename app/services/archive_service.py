@@ -0,0 +1,295 @@
+# app/services/archive_service.py
+"""
+Cold storage for old messages.
+
+Messages older than `settings.archive_after_days` are moved out of the `messages`
+table into per-room, append-only segment files:
+
+    {archive_dir}/room_{room_id}/{first_id:012d}-{last_id:012d}.seg
+
+A segment is a run of zlib-compressed blocks (NDJSON, `archive_block_size` messages each)
+followed by a footer holding a sparse index - one [first_id, last_id, offset, length]
+entry per block - so a page read only decompresses the blocks it needs.
+Segments are read through mmap and never modified; `compact_room` merges a room's
+segments into one. Id ranges of segments may overlap (a message with a lower id
+can turn cold after a later one was archived), so readers merge by id.
+"""
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from sqlmodel import Session, select, delete
+
+from app.core.config import settings
+from app.db.models import Attachment, Message, MessageSeen, User
+from app.services.attachment_service import attachment_payload
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b"CHATSEG1"
+FOOTER = struct.Struct("<Q8s")  # index length, magic
+
+
+class Segment:
+    """A read-only, memory-mapped segment file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_len, magic = FOOTER.unpack_from(self._mm, len(self._mm) - FOOTER.size)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"Not a message segment: {path}")
+        index_start = len(self._mm) - FOOTER.size - index_len
+        self.index = json.loads(self._mm[index_start:index_start + index_len])
+        self.first_ids = [entry[0] for entry in self.index]
+        self.first_id = self.index[0][0]
+        self.last_id = self.index[-1][1]
+
+    def read_block(self, i: int) -> list[dict]:
+        _, _, offset, length = self.index[i]
+        data = zlib.decompress(self._mm[offset:offset + length])
+        return [json.loads(line) for line in data.splitlines()]
+
+    def iter_blocks_before(self, before_id: int | None) -> Iterator[list[dict]]:
+        """Yield blocks newest-first, skipping blocks that only hold ids >= before_id."""
+        end = len(self.index) if before_id is None else bisect_left(self.first_ids, before_id)
+        for i in range(end - 1, -1, -1):
+            yield self.read_block(i)
+
+    def close(self):
+        self._mm.close()
+
+
+def _room_dir(room_id: int) -> str:
+    return os.path.join(settings.archive_dir, f"room_{room_id}")
+
+
+# room_id -> (room dir mtime, segments sorted by first_id). The archive and compact
+# jobs run in another process, so every lookup revalidates against the directory:
+# creating, renaming or removing a segment changes its mtime.
+_segment_cache: dict[int, tuple[int | None, list[Segment]]] = {}
+
+
+def get_segments(room_id: int) -> list[Segment]:
+    room_dir = _room_dir(room_id)
+    try:
+        mtime = os.stat(room_dir).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    cached = _segment_cache.get(room_id)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    # Replaced segments are not closed here: a concurrent reader may still hold them,
+    # and the mapping is released once the last reference goes away.
+    names = sorted(n for n in os.listdir(room_dir) if n.endswith(".seg")) if mtime is not None else []
+    segments = [Segment(os.path.join(room_dir, n)) for n in names]
+    _segment_cache[room_id] = (mtime, segments)
+    return segments
+
+
+def _invalidate(room_id: int):
+    _, segments = _segment_cache.pop(room_id, (None, []))
+    for segment in segments:
+        segment.close()
+
+
+def archived_high_water(room_id: int) -> int:
+    """Highest archived message id for a room (0 if nothing is archived)."""
+    segments = get_segments(room_id)
+    return max((s.last_id for s in segments), default=0)
+
+
+def write_segment(room_id: int, records: list[dict]) -> str:
+    """Write records (ascending by id) as a new segment; atomic via rename."""
+    room_dir = _room_dir(room_id)
+    os.makedirs(room_dir, exist_ok=True)
+    path = os.path.join(room_dir, f"{records[0]['id']:012d}-{records[-1]['id']:012d}.seg")
+    tmp_path = path + ".tmp"
+
+    index = []
+    with open(tmp_path, "wb") as f:
+        for i in range(0, len(records), settings.archive_block_size):
+            block = records[i:i + settings.archive_block_size]
+            data = zlib.compress(b"\n".join(json.dumps(r).encode() for r in block), 9)
+            index.append([block[0]["id"], block[-1]["id"], f.tell(), len(data)])
+            f.write(data)
+        index_data = json.dumps(index).encode()
+        f.write(index_data)
+        f.write(FOOTER.pack(len(index_data), SEGMENT_MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _invalidate(room_id)
+    return path
+
+
+def read_archived(room_id: int, before_id: int | None = None, limit: int = 50) -> list[dict]:
+    """Return up to `limit` archived messages with id < before_id, ascending by id."""
+    newest_first: list[dict] = []
+    for segment in sorted(get_segments(room_id), key=lambda s: s.last_id, reverse=True):
+        if before_id is not None and segment.first_id >= before_id:
+            continue
+        if len(newest_first) >= limit and segment.last_id < newest_first[limit - 1]["id"]:
+            break  # this and every remaining segment only hold older messages
+        taken = 0
+        for block in segment.iter_blocks_before(before_id):
+            for record in reversed(block):
+                if before_id is not None and record["id"] >= before_id:
+                    continue
+                newest_first.append(record)
+                taken += 1
+                if taken >= limit:
+                    break
+            if taken >= limit:
+                break
+        newest_first.sort(key=lambda r: r["id"], reverse=True)
+        del newest_first[limit:]
+    return newest_first[::-1]
+
+
+def _iter_segment(segment: Segment) -> Iterator[dict]:
+    for i in range(len(segment.index)):
+        yield from segment.read_block(i)
+
+
+def iter_archived(room_id: int) -> Iterator[dict]:
+    """Yield every archived message of a room, ascending by id."""
+    yield from heapq.merge(*(_iter_segment(s) for s in get_segments(room_id)), key=lambda r: r["id"])
+
+
+def archived_copies(room_id: int, hot_rows: dict[int, tuple[str, str]]) -> set[int]:
+    """
+    Which hot rows ({id: (timestamp iso, content)}) are already stored in the room's
+    segments. A match needs the same id, timestamp and content, so a row that merely
+    reuses an archived id is never taken for its copy. Only reads blocks that may hold them.
+    """
+    candidates = sorted(hot_rows)
+    found: set[int] = set()
+    for segment in get_segments(room_id):
+        for i, (first_id, last_id, _, _) in enumerate(segment.index):
+            lo = bisect_left(candidates, first_id)
+            if lo == len(candidates) or candidates[lo] > last_id:
+                continue
+            found.update(
+                r["id"] for r in segment.read_block(i)
+                if hot_rows.get(r["id"]) == (r["timestamp"], r["content"])
+            )
+    return found
+
+
+def max_archived_id() -> int:
+    """Highest message id in any room's archive (0 if nothing is archived)."""
+    if not os.path.isdir(settings.archive_dir):
+        return 0
+    return max(
+        (
+            archived_high_water(int(name.removeprefix("room_")))
+            for name in os.listdir(settings.archive_dir)
+            if name.startswith("room_")
+        ),
+        default=0,
+    )
+
+
+def archive_room(room_id: int, cutoff: datetime, session: Session, batch_size: int = 10_000) -> int:
+    """Move a room's messages older than `cutoff` into a new segment. Returns how many moved."""
+    high_water = archived_high_water(room_id)
+    if high_water:
+        # Rows already written to a segment by an interrupted run. Hot rows below the
+        # high water are not necessarily archived (a newer timestamp kept them back),
+        # so only delete the ones a segment holds an identical copy of.
+        below = session.exec(
+            select(Message.id, Message.timestamp, Message.content)
+            .where(Message.room_id == room_id, Message.id <= high_water)
+        ).all()
+        hot_rows = {message_id: (timestamp.isoformat(), content) for message_id, timestamp, content in below}
+        leftover = archived_copies(room_id, hot_rows) if hot_rows else set()
+        if leftover:
+            _delete_messages(session, list(leftover))
+            logger.info(f"archive_room: removed {len(leftover)} already archived messages of room {room_id}")
+
+    moved = 0
+    while True:
+        # Archived rows are deleted after each batch, so this always finds new ones
+        rows = session.exec(
+            select(Message, User.username, Attachment)
+            .join(User, Message.sender_id == User.id)
+            .outerjoin(Attachment, Message.attachment_id == Attachment.id)
+            .where(Message.room_id == room_id, Message.timestamp < cutoff)
+            .order_by(Message.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return moved
+
+        records = [
+            {
+                "id": m.id,
+                "room_id": m.room_id,
+                "sender_id": m.sender_id,
+                "sender": username,
+                "content": m.content,
+                "timestamp": m.timestamp.isoformat(),
+                "attachment": attachment_payload(attachment),
+            }
+            for m, username, attachment in rows
+        ]
+        write_segment(room_id, records)
+        # Exactly the rows in the segment: a range would also hit hot rows with lower ids
+        _delete_messages(session, [r["id"] for r in records])
+        moved += len(records)
+        logger.info(f"archive_room: moved {len(records)} messages of room {room_id} up to id {records[-1]['id']}")
+
+
+def _delete_messages(session: Session, ids: list[int]):
+    session.exec(delete(MessageSeen).where(MessageSeen.message_id.in_(ids)))
+    session.exec(delete(Message).where(Message.id.in_(ids)))
+    session.commit()
+
+
+def archive_old_messages(session: Session, older_than_days: int | None = None) -> int:
+    """Archive job: move every room's cold messages into segments."""
+    days = settings.archive_after_days if older_than_days is None else older_than_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    room_ids = session.exec(
+        select(Message.room_id).where(Message.timestamp < cutoff).distinct()
+    ).all()
+    return sum(archive_room(room_id, cutoff, session) for room_id in room_ids)
+
+
+def compact_room(room_id: int) -> bool:
+    """Merge all of a room's segments into one. Returns False if there was nothing to merge."""
+    segments = get_segments(room_id)
+    if len(segments) < 2:
+        return False
+
+    old_paths = [s.path for s in segments]
+    records = list(iter_archived(room_id))
+    new_path = write_segment(room_id, records)
+    for path in old_paths:
+        if path != new_path:
+            os.remove(path)
+    _invalidate(room_id)
+    logger.info(f"compact_room: merged {len(old_paths)} segments of room {room_id}")
+    return True
+
+
+def compact_archive() -> int:
+    """Compaction job: merge segments for every archived room."""
+    if not os.path.isdir(settings.archive_dir):
+        return 0
+    room_ids = [
+        int(name.removeprefix("room_"))
+        for name in os.listdir(settings.archive_dir)
+        if name.startswith("room_")
+    ]
+    return sum(compact_room(room_id) for room_id in room_ids)
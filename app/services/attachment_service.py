@@ -0,0 +1,99 @@
+# app/services/attachment_service.py
+"""
+Content-addressed attachment storage on local disk:
+
+    {attachments_dir}/blobs/ab/cd/abcd1234...   (sha256 of the bytes)
+
+Uploads stream to a temp file chunk by chunk while being hashed, then are
+renamed into place; an identical file that is already stored is reused.
+
+The content type is whatever the uploader declared, so downloads only render
+inline for types on INLINE_CONTENT_TYPES; everything else is served as an
+octet-stream download (an uploaded text/html must never run on our origin).
+"""
+import hashlib
+import os
+import re
+import uuid
+from urllib.parse import quote
+from typing import AsyncIterator
+
+import anyio
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.db.models import Attachment
+
+
+def attachment_payload(attachment: Attachment | None) -> dict | None:
+    """The lightweight reference sent to clients instead of the file itself."""
+    if attachment is None:
+        return None
+    return {
+        "id": attachment.id,
+        "filename": attachment.filename,
+        "size": attachment.size,
+        "content_type": attachment.content_type,
+        "url": f"/chat/attachments/{attachment.id}",
+    }
+
+
+# Types browsers display without running scripts (no HTML, SVG or XML)
+INLINE_CONTENT_TYPES = {
+    "image/png", "image/jpeg", "image/gif", "image/webp",
+    "audio/mpeg", "audio/ogg", "audio/wav", "video/mp4", "video/webm",
+    "application/pdf", "text/plain",
+}
+
+
+def download_headers(attachment: Attachment) -> tuple[str, dict]:
+    """Media type and the Content-Disposition / nosniff headers to serve an attachment with."""
+    content_type = attachment.content_type.split(";", 1)[0].strip().lower()
+    if content_type in INLINE_CONTENT_TYPES:
+        disposition, media_type = "inline", content_type
+    else:
+        disposition, media_type = "attachment", "application/octet-stream"
+    # Header values are latin-1: ASCII fallback for old clients, RFC 5987 for the real name
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', "_", attachment.filename) or "download"
+    utf8_name = quote(attachment.filename, safe="")
+    return media_type, {
+        "Content-Disposition": f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{utf8_name}",
+        "X-Content-Type-Options": "nosniff",
+    }
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(settings.attachments_dir, "blobs", sha256[:2], sha256[2:4], sha256)
+
+
+async def store_upload(chunks: AsyncIterator[bytes], max_bytes: int) -> tuple[str, int]:
+    """Write a streamed upload to disk without buffering it. Returns (sha256, size)."""
+    tmp_dir = os.path.join(settings.attachments_dir, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with await anyio.open_file(tmp_path, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail="Attachment too large")
+                digest.update(chunk)
+                await f.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty upload")
+
+        sha256 = digest.hexdigest()
+        final_path = blob_path(sha256)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)  # deduplicated: same bytes already stored
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+        return sha256, size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -2,7 +2,7 @@ from sqlmodel import Session, select
 from fastapi import Depends, HTTPException, status, WebSocket, Request
 from jose import JWTError
 from app.db.models import User
-from app.db.session import get_session
+from app.db.session import get_session, engine
 from app.utils.auth import hash_password, verify_password, oauth2_scheme, decode_access_token
 from app.core.config import settings
 
@@ -56,13 +56,12 @@ def get_current_user(request: Request, session: Session = Depends(get_session))
 
 
 
-async def get_current_user_ws(
-    websocket: WebSocket,
-    session: Session = Depends(get_session)
-) -> User:
+async def get_current_user_ws(websocket: WebSocket) -> User:
     """
     Extract user from WebSocket connection using JWT token.
     Token can come from query param, header, or cookie.
+    The lookup uses its own session, closed before returning, so the socket does not
+    pin a pooled connection; the returned User is detached.
     """
 
     token = None
@@ -93,7 +92,8 @@ async def get_current_user_ws(
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
     # Look up user in DB
-    user = session.get(User, user_id)
+    with Session(engine) as session:
+        user = session.get(User, user_id)
     if not user:
         await websocket.close(code=1008)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
@@ -1,6 +1,13 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from sqlmodel import Session, select
-from app.db.models import ChatRoom, Message, UserChatRoom, MessageSeen
+from app.db.models import ChatRoom, Message, UserChatRoom, MessageSeen, Attachment
 from app.db.models import User
+from app.utils.http_cache import bump_directory_version
+from app.services import archive_service
+from app.services.unread_service import unread_counters
+from app.services.history_service import history_pages
+from app.services.attachment_service import attachment_payload
 from fastapi import HTTPException
 import logging
 from datetime import datetime
@@ -15,6 +22,7 @@ def create_room(name: str, user: User, session: Session):
     link = UserChatRoom(user_id=user.id, room_id=room.id)
     session.add(link)
     session.commit()
+    bump_directory_version()
     return room
 
 def get_user_rooms(user: User, session: Session):
@@ -36,7 +44,7 @@ def get_room(room_id: int, user: User, session: Session):
     return room
 
 
-def send_message(room_id: int, content: str, sender: User, session: Session):
+def send_message(room_id: int, content: str, sender: User, session: Session, attachment_id: int | None = None):
     # 1. Check if room exists
     room = session.get(ChatRoom, room_id)
     if not room:
@@ -54,16 +62,62 @@ def send_message(room_id: int, content: str, sender: User, session: Session):
         content=content,
         sender_id=sender.id,
         room_id=room_id,
+        attachment_id=attachment_id,
         timestamp=datetime.utcnow()
     )
 
-    # 4. Save to DB
+    # 4. Save to DB. Closed history pages are cached forever, so an id that does not
+    # come after the room's latest one must never be committed.
+    latest = history_pages.latest(room_id, session)
     session.add(msg)
+    session.flush()
+    if msg.id <= latest:
+        session.rollback()
+        logging.error(f"send_message: id {msg.id} is not above room {room_id}'s latest id {latest}")
+        raise HTTPException(status_code=500, detail="Message id out of order")
     session.commit()
     session.refresh(msg)
 
+    # 5. Bump unread counters of the other members, advance the history pages
+    unread_counters.on_message(room_id, msg.id, sender.id, session)
+    history_pages.on_message(room_id, msg.id)
+
     return msg
 
+def send_attachment_message(
+    room_id: int, sender: User, session: Session,
+    sha256: str, size: int, content_type: str, filename: str, caption: str = "",
+) -> tuple[Message, Attachment]:
+    """Record an already stored upload and post it to the room as a message."""
+    if not is_user_member(sender.id, room_id, session):
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+
+    attachment = Attachment(
+        sha256=sha256,
+        size=size,
+        content_type=content_type,
+        filename=filename,
+        uploader_id=sender.id,
+        room_id=room_id,
+    )
+    session.add(attachment)
+    session.commit()
+    session.refresh(attachment)
+
+    msg = send_message(room_id, caption, sender, session, attachment_id=attachment.id)
+    return msg, attachment
+
+
+def get_attachment(attachment_id: int, user: User, session: Session) -> Attachment:
+    """Return an attachment if the user may read it (member of its room)."""
+    attachment = session.get(Attachment, attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    if not is_user_member(user.id, attachment.room_id, session):
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+    return attachment
+
+
 def get_room_messages(room_id: int, user: User, session: Session):
     # Check membership
     member_stmt = select(UserChatRoom).where(
@@ -72,9 +126,66 @@ def get_room_messages(room_id: int, user: User, session: Session):
     if not session.exec(member_stmt).first():
         raise HTTPException(status_code=403, detail="Not a member of this room")
     
-    stmt = select(Message).where(Message.room_id == room_id).order_by(Message.timestamp)
+    # Load senders in the same query; templates read `msg.sender.username`
+    stmt = (
+        select(Message)
+        .where(Message.room_id == room_id)
+        .options(joinedload(Message.sender))
+        .order_by(Message.timestamp)
+    )
     return session.exec(stmt).all()
 
+def get_room_history(room_id: int, user: User, session: Session, before_id: int | None = None, limit: int = 50) -> list[dict]:
+    """
+    Return up to `limit` messages with id < before_id (newest page if None), ascending,
+    read transparently across the hot `messages` table and the archive.
+    """
+    if not is_user_member(user.id, room_id, session):
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+    return read_history(room_id, session, before_id, limit)
+
+
+def read_history(room_id: int, session: Session, before_id: int | None = None, limit: int = 50) -> list[dict]:
+    """get_room_history without the membership check, for callers that already did it."""
+    stmt = (
+        select(Message, User.username, Attachment)
+        .join(User, Message.sender_id == User.id)
+        .outerjoin(Attachment, Message.attachment_id == Attachment.id)
+        .where(Message.room_id == room_id)
+        .order_by(Message.id.desc())
+        .limit(limit)
+    )
+    if before_id is not None:
+        stmt = stmt.where(Message.id < before_id)
+    hot = [
+        {
+            "id": m.id,
+            "sender": username,
+            "content": m.content,
+            "timestamp": m.timestamp.isoformat(),
+            "attachment": attachment_payload(attachment),
+        }
+        for m, username, attachment in session.exec(stmt).all()
+    ]
+
+    # Only touch the archive when it can contribute to this page
+    if len(hot) < limit or archive_service.archived_high_water(room_id) > hot[-1]["id"]:
+        archived = archive_service.read_archived(room_id, before_id, limit)
+        hot.extend(
+            {
+                "id": r["id"],
+                "sender": r["sender"],
+                "content": r["content"],
+                "timestamp": r["timestamp"],
+                "attachment": r.get("attachment"),
+            }
+            for r in archived
+        )
+        hot.sort(key=lambda r: r["id"], reverse=True)
+        hot = hot[:limit]
+
+    return hot[::-1]
+
 # Helper to check membership
 def is_user_member(user_id: int, room_id: int, session: Session) -> bool:
     return session.exec(
@@ -102,6 +213,8 @@ def join_room_service(room_id: int, user_id: int, session: Session) -> ChatRoom:
         membership = UserChatRoom(user_id=user_id, room_id=room_id)
         session.add(membership)
         session.commit()
+        unread_counters.on_join(room_id, user_id)
+        bump_directory_version()
     
     return room
 
@@ -122,42 +235,42 @@ def leave_room_service(room_id: int, user_id: int, session: Session) -> ChatRoom
     if membership:
         session.delete(membership)
         session.commit()
+        unread_counters.on_leave(room_id, user_id)
+        bump_directory_version()
 
     return room
 
 
-def get_membership_map(user_id: int, session: Session) -> dict[int, bool]:
+def get_room_directory(user_id: int, session: Session) -> tuple[list[ChatRoom], dict[int, bool]]:
     """
-    Returns a map {room_id: True/False} indicating whether the user is a member of each room.
+    Returns all rooms plus a map {room_id: True/False} indicating whether the user
+    is a member of each, from a single query (rooms outer-joined to the user's memberships).
     """
-    # Get all room memberships for the user
-    stmt = select(UserChatRoom.room_id).where(UserChatRoom.user_id == user_id)
-    memberships = session.exec(stmt).all()  # list of room_ids
-
-    # Build map: room_id -> True/False
-    membership_map = {room.id: (room.id in memberships) for room in session.exec(select(ChatRoom)).all()}
-    return membership_map
+    rows = session.exec(
+        select(ChatRoom, UserChatRoom.user_id)
+        .outerjoin(
+            UserChatRoom,
+            (UserChatRoom.room_id == ChatRoom.id) & (UserChatRoom.user_id == user_id),
+        )
+        .order_by(ChatRoom.id)
+    ).all()
+    rooms = [room for room, _ in rows]
+    membership_map = {room.id: member_id is not None for room, member_id in rows}
+    return rooms, membership_map
 
 
 def mark_message_seen(message_id: int, user_id: int, session: Session) -> MessageSeen | None:
     """Mark a message as seen by a user, return the MessageSeen entry (or None if already seen)."""
-
-    seen_entry = session.exec(
-        select(MessageSeen).where(
-            (MessageSeen.message_id == message_id) &
-            (MessageSeen.user_id == user_id)
-        )
-    ).first()
-
-    if seen_entry:
-        return None  # Already marked as seen
-
     seen_entry = MessageSeen(
         message_id=message_id,
         user_id=user_id,
         seen_at=datetime.utcnow()
     )
     session.add(seen_entry)
-    session.commit()
-    session.refresh(seen_entry)
+    try:
+        # Unique (message_id, user_id): a duplicate fails here instead of needing a SELECT first
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        return None  # Already marked as seen
     return seen_entry
\ No newline at end of file
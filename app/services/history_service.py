@@ -0,0 +1,94 @@
+# app/services/history_service.py
+"""
+Fixed-size history pages for HTTP scrollback.
+
+A room's history is cut into pages of `history_page_size` messages, chained
+backwards from an anchor. The open page is every message with id >= anchor and
+is the only page that changes. Closed pages are addressed by message id: page
+`before_id` is the `history_page_size` messages with id < before_id, and it
+links to the page before its own first id. Ids are only ever appended, so a
+closed page never changes. The anchor only moves forward by a whole page, so
+every client walks the same chain of URLs and the pages can be cached forever.
+"""
+import hashlib
+
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.db.models import Message
+from app.services import archive_service
+from app.utils.templates import templates
+
+HISTORY_TEMPLATE = "partials/message_list.html"
+
+# Part of every page URL and ETag: a template or page size change must not be
+# answered from caches that hold pages rendered the old way.
+HISTORY_VERSION = hashlib.sha256(
+    f"{settings.history_page_size}:".encode()
+    + templates.env.loader.get_source(templates.env, HISTORY_TEMPLATE)[0].encode()
+).hexdigest()[:12]
+
+
+def history_page_url(room_id: int, before_id: int) -> str:
+    return f"/chat/rooms/{room_id}/history/{before_id}?v={HISTORY_VERSION}"
+
+
+def history_etag(room_id: int, before_id: int) -> str:
+    return f'"history-{room_id}-{before_id}-{HISTORY_VERSION}"'
+
+
+class HistoryPages:
+    """
+    Per-room page anchors, kept in process (like unread counters: assumes a single
+    worker) and loaded lazily from the newest page of the room.
+    """
+
+    def __init__(self, page_size: int):
+        self.page_size = page_size
+        self.rooms: dict[int, list[int]] = {}  # room_id -> [anchor_id, open_count, latest_id]
+
+    def _state(self, room_id: int, session: Session) -> list[int]:
+        state = self.rooms.get(room_id)
+        if state is None:
+            ids = list(session.exec(
+                select(Message.id)
+                .where(Message.room_id == room_id)
+                .order_by(Message.id.desc())
+                .limit(self.page_size)
+            ).all())
+            if len(ids) < self.page_size:
+                older = archive_service.read_archived(room_id, ids[-1] if ids else None, self.page_size - len(ids))
+                ids.extend(r["id"] for r in reversed(older))
+            # The archive may hold newer ids than the hot table (quiet rooms are archived whole)
+            latest = max(ids[0] if ids else 0, archive_service.archived_high_water(room_id))
+            state = [ids[-1], len(ids), latest] if ids else [0, 0, latest]
+            self.rooms[room_id] = state
+        return state
+
+    def anchor(self, room_id: int, session: Session) -> int:
+        """First id of the open page (0 while the room is empty)."""
+        return self._state(room_id, session)[0]
+
+    def open_count(self, room_id: int, session: Session) -> int:
+        return self._state(room_id, session)[1]
+
+    def latest(self, room_id: int, session: Session) -> int:
+        return self._state(room_id, session)[2]
+
+    def is_closed(self, room_id: int, before_id: int, session: Session) -> bool:
+        """Every message below `before_id` already exists, so that page can never change."""
+        return before_id <= self.latest(room_id, session)
+
+    def on_message(self, room_id: int, message_id: int):
+        state = self.rooms.get(room_id)
+        if state is None:
+            return  # loaded on first use
+        state[2] = message_id
+        if state[1] == 0 or state[1] >= self.page_size:
+            # First message, or the open page is full: close it and start a new one here
+            state[0], state[1] = message_id, 1
+        else:
+            state[1] += 1
+
+
+history_pages = HistoryPages(settings.history_page_size)
@@ -0,0 +1,297 @@
+# app/services/transfer_service.py
+"""
+Room history export/import as NDJSON, one record per line:
+
+    {"kind": "room", "id": 1, "name": "general"}
+    {"kind": "user", "id": 7, "username": "alice"}
+    {"kind": "membership", "user_id": 7, "room_id": 1}
+    {"kind": "message", "id": 42, "room_id": 1, "sender_id": 7, "content": "hi", "timestamp": "..."}
+
+Records only reference ids that appeared earlier in the stream. Export pages
+through the archive and then the `messages` table with a server-side cursor,
+so memory stays flat at any room size. Import buffers records and writes them
+in large executemany batches, one transaction per batch.
+"""
+import json
+import logging
+import secrets
+import time
+from datetime import datetime
+from typing import Iterator
+
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.db.models import ChatRoom, Message, User, UserChatRoom
+from app.db.session import engine
+from app.services import archive_service
+from app.utils.auth import UNUSABLE_PASSWORD
+from app.utils.http_cache import bump_directory_version
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Imported authors become placeholder accounts identified by this email domain.
+# It is a reserved name that registration's email validation rejects, so no real
+# account can ever be matched (and impersonated) by an import.
+IMPORTED_EMAIL_DOMAIN = "imported.invalid"
+IMPORTED_USERNAME_PREFIX = "imported:"
+
+# kind -> required fields and their types
+RECORD_FIELDS: dict[str, dict[str, type]] = {
+    "room": {"id": int, "name": str},
+    "user": {"id": int, "username": str},
+    "membership": {"user_id": int, "room_id": int},
+    "message": {"room_id": int, "sender_id": int, "content": str, "timestamp": str},
+}
+
+
+def validate_record(record) -> dict:
+    """Check one parsed import line; raise ValueError describing the first problem."""
+    if not isinstance(record, dict):
+        raise ValueError("record must be a JSON object")
+    if not isinstance(record.get("kind"), str):
+        raise ValueError("record: 'kind' must be str")
+    fields = RECORD_FIELDS.get(record["kind"], {})
+    for name, expected in fields.items():
+        value = record.get(name)
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise ValueError(f"{record['kind']} record: '{name}' must be {expected.__name__}")
+    if record.get("kind") == "user" and not record["username"]:
+        raise ValueError("user record: 'username' must not be empty")
+    if record.get("kind") == "message":
+        try:
+            datetime.fromisoformat(record["timestamp"])
+        except ValueError:
+            raise ValueError("message record: 'timestamp' must be an ISO 8601 date") from None
+    return record
+
+
+def _line(record: dict) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def export_room(room_id: int) -> Iterator[bytes]:
+    """Yield a room's full history as NDJSON chunks, using its own short-lived session."""
+    started = time.perf_counter()
+    rows = 0
+    buffer: list[str] = []
+    buffered = 0
+
+    def emit(record: dict):
+        nonlocal rows, buffered
+        rows += 1
+        line = _line(record)
+        buffer.append(line)
+        buffered += len(line)
+
+    def flush() -> bytes:
+        nonlocal buffered
+        chunk = "".join(buffer).encode()
+        buffer.clear()
+        buffered = 0
+        return chunk
+
+    with Session(engine) as session:
+        room = session.get(ChatRoom, room_id)
+        emit({"kind": "room", "id": room.id, "name": room.name})
+
+        users_sent: set[int] = set()
+        members = session.exec(
+            select(User.id, User.username)
+            .join(UserChatRoom, UserChatRoom.user_id == User.id)
+            .where(UserChatRoom.room_id == room_id)
+            .execution_options(yield_per=settings.export_batch_size)
+        )
+        for user_id, username in members:
+            users_sent.add(user_id)
+            emit({"kind": "user", "id": user_id, "username": username})
+            emit({"kind": "membership", "user_id": user_id, "room_id": room_id})
+
+        def emit_message(message_id, sender_id, username, content, timestamp):
+            if sender_id not in users_sent:  # former member
+                users_sent.add(sender_id)
+                emit({"kind": "user", "id": sender_id, "username": username})
+            emit({
+                "kind": "message",
+                "id": message_id,
+                "room_id": room_id,
+                "sender_id": sender_id,
+                "content": content,
+                "timestamp": timestamp,
+            })
+
+        for r in archive_service.iter_archived(room_id):
+            emit_message(r["id"], r["sender_id"], r["sender"], r["content"], r["timestamp"])
+            if buffered >= EXPORT_CHUNK_BYTES:
+                yield flush()
+
+        hot = session.exec(
+            select(Message.id, Message.sender_id, User.username, Message.content, Message.timestamp)
+            .join(User, Message.sender_id == User.id)
+            .where(Message.room_id == room_id)
+            .order_by(Message.id)
+            .execution_options(yield_per=settings.export_batch_size)
+        )
+        for message_id, sender_id, username, content, timestamp in hot:
+            emit_message(message_id, sender_id, username, content, timestamp.isoformat())
+            if buffered >= EXPORT_CHUNK_BYTES:
+                yield flush()
+
+    elapsed = time.perf_counter() - started
+    rows_per_sec = round(rows / elapsed) if elapsed else rows
+    logger.info(f"export_room: room {room_id}, {rows} rows in {elapsed:.2f}s ({rows_per_sec} rows/s)")
+    emit({"kind": "export_summary", "rows": rows, "seconds": round(elapsed, 3), "rows_per_sec": rows_per_sec})
+    yield flush()
+
+
+class RoomImporter:
+    """
+    Incremental NDJSON importer. Feed validated records with `add`, then call `finish`.
+    The importing user's own username maps to their account. Every other author
+    maps to an "imported:<username>" placeholder (unverified, no password),
+    never to an existing account, so an import can't post as someone else.
+    Rooms are always created fresh. Legacy ids are remapped.
+    """
+
+    def __init__(self, session: Session, batch_size: int, owner: User):
+        self.session = session
+        self.batch_size = batch_size
+        self.owner_id = owner.id
+        self.owner_username = owner.username
+        self.user_ids: dict[int, int] = {}  # legacy id -> local id
+        self.room_ids: dict[int, int] = {}
+        self.pending: dict[str, list[dict]] = {"user": [], "room": [], "membership": [], "message": []}
+        self.counts = {"users": 0, "rooms": 0, "memberships": 0, "messages": 0, "skipped": 0}
+        self.started = time.perf_counter()
+
+    def add(self, record: dict):
+        kind = record.get("kind")
+        if kind not in self.pending:
+            return  # export_summary and unknown kinds
+        self.pending[kind].append(record)
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush()
+
+    def add_all(self, records: list[dict]):
+        for record in records:
+            self.add(record)
+
+    def flush(self):
+        # Parents first, so membership/message batches can be remapped
+        self._flush_users()
+        self._flush_rooms()
+        self._flush_memberships()
+        self._flush_messages()
+        self.session.commit()
+
+    def _flush_users(self):
+        records = self.pending["user"]
+        if not records:
+            return
+        by_name = {r["username"]: r["id"] for r in records}
+        if self.owner_username in by_name:
+            self.user_ids[by_name.pop(self.owner_username)] = self.owner_id
+
+        if not by_name:
+            records.clear()
+            return
+
+        # Placeholders are looked up by email: a real account can't hold that domain.
+        # One query finds both existing placeholders and usernames already taken.
+        emails = {name: f"{IMPORTED_USERNAME_PREFIX}{name}@{IMPORTED_EMAIL_DOMAIN}" for name in by_name}
+        usernames = {name: f"{IMPORTED_USERNAME_PREFIX}{name}" for name in by_name}
+        rows = self.session.exec(
+            select(User.email, User.username, User.id).where(
+                User.email.in_(list(emails.values())) | User.username.in_(list(usernames.values()))
+            )
+        ).all()
+        existing = {email: user_id for email, _, user_id in rows}
+        taken = {username for _, username, _ in rows}
+        missing = [name for name in by_name if emails[name] not in existing]
+        if missing:
+            for name in missing:
+                if usernames[name] in taken:  # registered by a real user; keep clear of it
+                    usernames[name] += f":{secrets.token_hex(3)}"
+            now = datetime.utcnow()
+            # Plain executemany: RETURNING with sort_by_parameter_order degrades to one
+            # INSERT per row on SQLite, so read the new ids back in one query instead
+            self.session.execute(insert(User), [
+                {
+                    "username": usernames[name],
+                    "email": emails[name],
+                    "hashed_password": UNUSABLE_PASSWORD,
+                    "created_at": now,
+                    "is_verified": False,
+                }
+                for name in missing
+            ])
+            existing.update(self.session.exec(
+                select(User.email, User.id).where(User.email.in_([emails[name] for name in missing]))
+            ).all())
+            self.counts["users"] += len(missing)
+        for name, legacy_id in by_name.items():
+            self.user_ids[legacy_id] = existing[emails[name]]
+        records.clear()
+
+    def _flush_rooms(self):
+        records = self.pending["room"]
+        if not records:
+            return
+        new_ids = self.session.execute(
+            insert(ChatRoom).returning(ChatRoom.id, sort_by_parameter_order=True),
+            [{"name": r["name"]} for r in records],
+        ).scalars().all()
+        for record, new_id in zip(records, new_ids):
+            self.room_ids[record["id"]] = new_id
+        self.counts["rooms"] += len(records)
+        records.clear()
+
+    def _flush_memberships(self):
+        records = self.pending["membership"]
+        if not records:
+            return
+        rows = set()
+        for r in records:
+            user_id, room_id = self.user_ids.get(r["user_id"]), self.room_ids.get(r["room_id"])
+            if user_id is None or room_id is None:
+                self.counts["skipped"] += 1
+                continue
+            rows.add((user_id, room_id))
+        if rows:
+            self.session.execute(insert(UserChatRoom), [{"user_id": u, "room_id": r} for u, r in rows])
+            self.counts["memberships"] += len(rows)
+        records.clear()
+
+    def _flush_messages(self):
+        records = self.pending["message"]
+        if not records:
+            return
+        rows = []
+        for r in records:
+            sender_id, room_id = self.user_ids.get(r["sender_id"]), self.room_ids.get(r["room_id"])
+            if sender_id is None or room_id is None:
+                self.counts["skipped"] += 1
+                continue
+            rows.append({
+                "content": r["content"],
+                "timestamp": datetime.fromisoformat(r["timestamp"]),
+                "sender_id": sender_id,
+                "room_id": room_id,
+            })
+        if rows:
+            self.session.execute(insert(Message), rows)
+            self.counts["messages"] += len(rows)
+        records.clear()
+
+    def finish(self) -> dict:
+        self.flush()
+        if self.counts["rooms"]:
+            bump_directory_version()
+        elapsed = time.perf_counter() - self.started
+        rows = sum(v for k, v in self.counts.items() if k != "skipped")
+        rows_per_sec = round(rows / elapsed) if elapsed else rows
+        logger.info(f"import: {rows} rows in {elapsed:.2f}s ({rows_per_sec} rows/s)")
+        return {**self.counts, "seconds": round(elapsed, 3), "rows_per_sec": rows_per_sec}
@@ -0,0 +1,136 @@
+# app/services/unread_service.py
+"""
+Unread counters per (user, room), kept in memory and updated incrementally:
+send_message bumps every other member, advancing the read position resets them.
+Dirty entries are written to `room_read_state` every `unread_snapshot_seconds`
+and loaded back on startup, so a crash loses at most one snapshot interval.
+"""
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.db.models import Message, RoomReadState, UserChatRoom
+from app.db.session import engine
+from app.services.history_service import history_pages
+
+logger = logging.getLogger(__name__)
+
+
+class UnreadCounters:
+    def __init__(self):
+        self.counts: dict[int, dict[int, int]] = {}       # user_id -> {room_id: unread}
+        self.last_read: dict[tuple[int, int], int] = {}   # (user_id, room_id) -> message id
+        self.room_members: dict[int, set[int]] = {}       # room_id -> user_ids (lazy cache)
+        self.user_versions: dict[int, int] = {}           # user_id -> bumped on any change
+        self._dirty: set[tuple[int, int]] = set()
+
+    def load(self, session: Session):
+        for state in session.exec(select(RoomReadState)).all():
+            self.counts.setdefault(state.user_id, {})[state.room_id] = state.unread_count
+            self.last_read[(state.user_id, state.room_id)] = state.last_read_message_id
+
+    def _set(self, user_id: int, room_id: int, count: int):
+        self.counts.setdefault(user_id, {})[room_id] = count
+        self.user_versions[user_id] = self.user_versions.get(user_id, 0) + 1
+        self._dirty.add((user_id, room_id))
+
+    def members(self, room_id: int, session: Session) -> set[int]:
+        members = self.room_members.get(room_id)
+        if members is None:
+            members = set(session.exec(select(UserChatRoom.user_id).where(UserChatRoom.room_id == room_id)).all())
+            self.room_members[room_id] = members
+        return members
+
+    def get(self, user_id: int, room_id: int) -> int:
+        return self.counts.get(user_id, {}).get(room_id, 0)
+
+    def get_unread_map(self, user_id: int) -> dict[int, int]:
+        return self.counts.get(user_id, {})
+
+    def version(self, user_id: int) -> int:
+        return self.user_versions.get(user_id, 0)
+
+    def on_message(self, room_id: int, message_id: int, sender_id: int, session: Session) -> list[int]:
+        """Bump every member but the sender. Returns the user ids whose count changed."""
+        self.last_read[(sender_id, room_id)] = message_id
+        changed = []
+        if self.get(sender_id, room_id):
+            # Posting in a room means the sender has caught up with it
+            self._set(sender_id, room_id, 0)
+            changed.append(sender_id)
+        for user_id in self.members(room_id, session):
+            if user_id != sender_id:
+                self._set(user_id, room_id, self.get(user_id, room_id) + 1)
+                changed.append(user_id)
+        return changed
+
+    def mark_read(self, user_id: int, room_id: int, message_id: int, session: Session) -> bool:
+        """Advance the read position. Returns True if the unread count changed."""
+        key = (user_id, room_id)
+        if message_id <= self.last_read.get(key, 0):
+            return False
+        self.last_read[key] = message_id
+
+        # The latest id is loaded from the room (hot table, then archive) after a restart
+        if message_id >= history_pages.latest(room_id, session):
+            count = 0
+        else:
+            # Read up to the middle of the room: count what is left
+            count = session.exec(
+                select(func.count()).select_from(Message)
+                .where(Message.room_id == room_id, Message.id > message_id)
+            ).one()
+        if count == self.get(user_id, room_id):
+            self._dirty.add(key)
+            return False
+        self._set(user_id, room_id, count)
+        return True
+
+    def on_join(self, room_id: int, user_id: int):
+        if room_id in self.room_members:
+            self.room_members[room_id].add(user_id)
+
+    def on_leave(self, room_id: int, user_id: int):
+        if room_id in self.room_members:
+            self.room_members[room_id].discard(user_id)
+        if self.get(user_id, room_id):
+            self._set(user_id, room_id, 0)
+
+    def snapshot(self, session: Session) -> int:
+        """Write dirty counters to `room_read_state`. Returns how many rows were written."""
+        dirty, self._dirty = self._dirty, set()
+        now = datetime.utcnow()
+        try:
+            for user_id, room_id in dirty:
+                session.merge(RoomReadState(
+                    user_id=user_id,
+                    room_id=room_id,
+                    unread_count=self.get(user_id, room_id),
+                    last_read_message_id=self.last_read.get((user_id, room_id), 0),
+                    updated_at=now,
+                ))
+            session.commit()
+        except Exception:
+            self._dirty |= dirty  # retry on the next snapshot
+            raise
+        return len(dirty)
+
+
+unread_counters = UnreadCounters()
+
+
+async def snapshot_loop():
+    """Background task: periodically persist unread counters."""
+    while True:
+        await asyncio.sleep(settings.unread_snapshot_seconds)
+        try:
+            with Session(engine) as session:
+                written = unread_counters.snapshot(session)
+            if written:
+                logger.info(f"unread snapshot: wrote {written} counters")
+        except Exception:
+            logger.exception("unread snapshot failed")
@@ -4,6 +4,10 @@ window.messageQueue = window.messageQueue || [];
 window.typingTimer = window.typingTimer || null;
 window.isTyping = window.isTyping || false;
 window.TYPING_IDLE_MS = window.TYPING_IDLE_MS || 2000; // stop after 2s idle
+window.olderHistoryUrl = window.olderHistoryUrl || null;
+window.loadingHistory = window.loadingHistory || false;
+window.reconnectAttempts = window.reconnectAttempts || 0;
+window.retryAfterMs = window.retryAfterMs || null; // server hint from a "retry" frame
 
 // Generate simple unique ID
 function generateTempId() {
@@ -26,10 +30,23 @@ function loadRoom(roomId) {
     setTimeout(() => connectWebSocket(roomId), 100);
 }
 
+// --------------------------
+// Attachment link (built with textContent so filenames are never parsed as HTML)
+// --------------------------
+function appendAttachment(div, attachment) {
+  if (!attachment) return;
+  const link = document.createElement("a");
+  link.href = attachment.url;
+  link.target = "_blank";
+  link.className = "block underline text-sm";
+  link.textContent = `📎 ${attachment.filename} (${Math.ceil(attachment.size / 1024)} KB)`;
+  div.appendChild(link);
+}
+
 // --------------------------
 // Render a single message
 // --------------------------
-function renderMessage({ sender, content = "", timestamp = null, type = "chat_message", message = "", tempId = null, id = null, status = null }) {
+function renderMessage({ sender, content = "", timestamp = null, type = "chat_message", message = "", tempId = null, id = null, status = null, attachment = null }) {
   const chatMessages = document.getElementById("chat-messages");
   if (!chatMessages) return;
 
@@ -62,12 +79,55 @@ function renderMessage({ sender, content = "", timestamp = null, type = "chat_me
       <small class="text-gray-500 text-xs">${timestamp ? new Date(timestamp).toLocaleString() : ""}</small>
       ${statusText}
     `;
+    appendAttachment(div, attachment);
   }
 
   // chatMessages.appendChild(div);
   chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
+// --------------------------
+// Scrollback over HTTP: closed history pages never change, so the browser
+// serves pages it has seen before from its cache
+// --------------------------
+async function requestOlderHistory() {
+  const chatMessages = document.getElementById("chat-messages");
+  if (!chatMessages || !olderHistoryUrl || loadingHistory) return;
+
+  loadingHistory = true;
+  const roomId = currentRoomId;
+  try {
+    const res = await fetch(olderHistoryUrl);
+    if (res.ok && roomId === currentRoomId) prependHistoryPage(await res.text());
+  } finally {
+    loadingHistory = false;
+  }
+}
+
+// Prepend a rendered history page, keeping the scroll position
+function prependHistoryPage(html) {
+  const chatMessages = document.getElementById("chat-messages");
+  if (!chatMessages) return;
+
+  const page = document.createElement("template");
+  page.innerHTML = html;
+  const older = page.content.querySelector("[data-older-url]");
+  olderHistoryUrl = older ? older.dataset.olderUrl : null;
+
+  const previousHeight = chatMessages.scrollHeight;
+  const first = chatMessages.firstChild;
+  page.content.querySelectorAll("[data-message-id]").forEach(div => {
+    // The newest page from the WebSocket can overlap the first closed page
+    if (chatMessages.querySelector(`[data-message-id="${div.dataset.messageId}"]`)) return;
+    // Pages are shared by all members; personalise them here
+    if (div.dataset.sender === window.currentUsername) div.querySelector("strong").textContent = "You:";
+    const time = div.querySelector("[data-timestamp]");
+    if (time) time.textContent = new Date(time.dataset.timestamp).toLocaleString();
+    chatMessages.insertBefore(div, first);
+  });
+  chatMessages.scrollTop = chatMessages.scrollHeight - previousHeight;
+}
+
 // --------------------------
 // Attach send message handler, queue the message if web socket is not connected
 // --------------------------
@@ -108,6 +168,16 @@ function attachMessageFormHandler() {
       clearTimeout(typingTimer);
     }
   };
+  // Attachments are uploaded over HTTP; the server broadcasts a reference to the room
+  const fileInput = document.getElementById("attachment-input");
+  if (fileInput) {
+    fileInput.onchange = () => {
+      const file = fileInput.files[0];
+      if (file) uploadAttachment(file, input.value.trim());
+      fileInput.value = "";
+      input.value = "";
+    };
+  }
   // TYPING indicator: start on input, stop after idle
   input.oninput = () => {
     if (!isTyping) {
@@ -125,6 +195,25 @@ function attachMessageFormHandler() {
 }
 
 
+// --------------------------
+// Upload an attachment as the raw request body (streamed to disk server-side)
+// --------------------------
+async function uploadAttachment(file, caption) {
+  const params = new URLSearchParams({ filename: file.name, caption });
+  const res = await fetch(`/chat/rooms/${currentRoomId}/attachments?${params}`, {
+    method: "POST",
+    headers: { "Content-Type": file.type || "application/octet-stream" },
+    body: file,
+  });
+  if (!res.ok) {
+    const err = await res.json().catch(() => ({}));
+    alert(err.detail || "Upload failed");
+    return;
+  }
+  // Our own broadcast is skipped, so render from the response
+  renderMessage({ ...(await res.json()), status: "sent" });
+}
+
 // --------------------------
 // Connect to WebSocket
 // --------------------------
@@ -147,6 +236,7 @@ function connectWebSocket(roomId) {
 
   socket.onopen = () => {
     console.log(`✅ Connected to room ${roomId}`);
+    reconnectAttempts = 0;
     if (chatMessages) chatMessages.innerHTML = "";
     attachMessageFormHandler();
 
@@ -161,6 +251,17 @@ function connectWebSocket(roomId) {
   socket.onmessage = (event) => {
     const data = JSON.parse(event.data);
 
+    if (data.type === "ping") {
+        socket.send(JSON.stringify({ type: "pong" }));
+        return;
+    }
+
+    if (data.type === "retry") {
+        // Server is busy admitting other clients; onclose reconnects after this delay
+        retryAfterMs = data.retry_after_ms;
+        return;
+    }
+
     if (data.type === "history") {
         // Clear messages before rendering history
         if (chatMessages) chatMessages.innerHTML = "";
@@ -171,7 +272,22 @@ function connectWebSocket(roomId) {
             timestamp: m.timestamp,
             status: "sent",
             id: m.id,
+            attachment: m.attachment,
         }));
+        olderHistoryUrl = data.older_url;
+        if (chatMessages) {
+          chatMessages.onscroll = () => {
+            if (chatMessages.scrollTop === 0) requestOlderHistory();
+          };
+          // Not enough to scroll yet: fill the view with older pages
+          if (chatMessages.scrollHeight <= chatMessages.clientHeight) requestOlderHistory();
+        }
+    } else if (data.type === "error" && data.code === "rate_limited") {
+        loadingHistory = false;
+        const pending = data.tempId && chatMessages.querySelector(`[data-temp-id="${data.tempId}"]`);
+        if (pending) {
+            pending.querySelector("small:last-of-type").textContent = "(not sent: slow down)";
+        }
     } else if (data.type === "error") {
         alert(data.message);
 
@@ -243,6 +359,13 @@ function connectWebSocket(roomId) {
           el.textContent = `Several people are typing…`;
           el.classList.remove("hidden");
         }
+    } else if (data.type === "unread_update") {
+        const badge = document.querySelector(`[data-unread-room-id="${data.room_id}"]`);
+        if (badge) {
+            badge.textContent = data.count;
+            badge.classList.toggle("hidden", data.count === 0);
+        }
+
     } else if (data.type === "online_status") {
         const list = document.getElementById("online-users-list");
         list.innerHTML = ""; // clear old list
@@ -272,8 +395,21 @@ function connectWebSocket(roomId) {
 
 
 
-  socket.onclose = () => {
-    console.log(`❌ Disconnected from room ${roomId}`); socket = null; };
+  socket.onclose = (event) => {
+    console.log(`❌ Disconnected from room ${roomId}`); socket = null;
+
+    // Not a member: reconnecting will not help
+    if (event.code === 1008 || currentRoomId !== roomId) return;
+
+    // Use the server's retry hint, else exponential backoff; jitter spreads clients out
+    const base = retryAfterMs ?? Math.min(30000, 1000 * 2 ** reconnectAttempts);
+    const delay = retryAfterMs !== null ? base : base / 2 + Math.random() * base;
+    retryAfterMs = null;
+    reconnectAttempts++;
+    setTimeout(() => {
+      if (currentRoomId === roomId && !socket) connectWebSocket(roomId);
+    }, delay);
+  };
 
   socket.onerror = (err) => console.error("WebSocket error:", err);
 }
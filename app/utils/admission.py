@@ -0,0 +1,61 @@
+# app/utils/admission.py
+import asyncio
+import random
+
+
+class AdmissionController:
+    """
+    Bounds how many WebSocket joins (auth, membership check, history load,
+    announcements) run at once. Joins over the limit wait in a bounded queue;
+    when that is full, or the wait times out, the client is told to retry later
+    with a jittered delay so reconnects spread out instead of arriving together.
+    """
+
+    def __init__(self, max_inflight: int, max_queued: int, queue_timeout: float, retry_after: float, retry_jitter: float):
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after_base = retry_after
+        self.retry_jitter = retry_jitter
+        self._slots = asyncio.Semaphore(max_inflight)
+        self.inflight = 0
+        self.waiting = 0
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+
+    @property
+    def storm(self) -> bool:
+        """True while joins are piling up; callers batch their announcements."""
+        return self.waiting > 0 or self.inflight * 2 >= self.max_inflight
+
+    async def acquire(self) -> bool:
+        """Wait for a join slot. Returns False if the client should retry later."""
+        if self._slots.locked():
+            if self.waiting >= self.max_queued:
+                self.stats["rejected"] += 1
+                return False
+            self.waiting += 1
+            self.stats["queued"] += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.stats["timed_out"] += 1
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        self.inflight += 1
+        self.stats["admitted"] += 1
+        return True
+
+    def release(self):
+        self.inflight -= 1
+        self._slots.release()
+
+    def retry_after(self) -> float:
+        """Seconds the client should wait: grows with the backlog, plus random jitter."""
+        backlog = self.waiting / self.max_queued if self.max_queued else 1
+        return self.retry_after_base * (1 + backlog) + random.uniform(0, self.retry_jitter)
+
+    def get_stats(self) -> dict:
+        return {"inflight": self.inflight, "waiting": self.waiting, **self.stats}
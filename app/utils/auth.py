@@ -13,6 +13,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+UNUSABLE_PASSWORD = "!"  # stored instead of a hash for accounts that can't log in
 
 
 # JWT settings from config
@@ -24,6 +25,8 @@ def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
+    if hashed == UNUSABLE_PASSWORD:
+        return False
     return pwd_context.verify(password, hashed)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
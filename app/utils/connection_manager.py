@@ -1,87 +1,335 @@
 # app/utils/connection_manager.py
-from typing import Dict, List
+import asyncio
+import itertools
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Callable
 from fastapi import WebSocket
 from app.db.models import User
 
+logger = logging.getLogger(__name__)
 
-class ConnectionManager:
-    def __init__(self):
-        # { room_id: [ (websocket, user), ... ] }
-        self.active_connections: Dict[int, List[tuple[WebSocket, User]]] = {}
-        self.user_connections: dict[int, WebSocket] = {}  # user_id -> WebSocket
-        self.typing_users: dict[int, set] = {}  # room_id -> set of user_ids
-
-    async def connect(self, websocket: WebSocket, room_id: int, user: User):
-        """Register a new websocket connection for a user in a room."""
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        self.active_connections[room_id].append((websocket, user))
-
-    def disconnect(self, websocket: WebSocket, room_id: int, user: User):
-        """Remove a websocket connection when user disconnects."""
-        if room_id in self.active_connections:
-            self.active_connections[room_id] = [
-                (ws, u) for ws, u in self.active_connections[room_id] if ws != websocket
-            ]
-            # Clean up empty room
-            if not self.active_connections[room_id]:
-                del self.active_connections[room_id]
+# Delivery classes: durable events (chat_message, system, history, error, ...) are
+# always delivered in order; ephemeral ones only matter in their latest state.
+EPHEMERAL_TYPES = {"typing_update", "online_status", "seen_update", "unread_update"}
 
-    async def broadcast(self, room_id: int, message: dict):
-        """Send a message to all users in a room."""
-        if room_id not in self.active_connections:
+
+def coalesce_key(message: dict) -> tuple:
+    """Ephemeral events with the same key supersede each other."""
+    if message["type"] == "seen_update":
+        return (message["type"], message.get("message_id"))
+    return (message["type"], message.get("room_id"))
+
+
+class UserRef:
+    """
+    The only user data a connection keeps: no ORM state, no password hash.
+    Interned per user by ConnectionManager, so every tab of a user shares one.
+    """
+
+    __slots__ = ("id", "username")
+
+    def __init__(self, id: int, username: str):
+        self.id = id
+        self.username = username
+
+
+class Connection:
+    """
+    Compact record for one WebSocket: id, user, rooms and its send queue.
+
+    Durable events are sent first, in FIFO order. Ephemeral events are kept
+    latest-wins per coalesce_key and are shed while the connection is behind.
+    The queues and the writer task only exist while there is something to send,
+    so an idle connection is just this record.
+    """
+
+    __slots__ = ("conn_id", "websocket", "user", "rooms", "durable", "ephemeral", "closed", "_writer", "_manager")
+
+    def __init__(self, conn_id: int, websocket: WebSocket, user: UserRef, manager: "ConnectionManager"):
+        self.conn_id = conn_id
+        self.websocket = websocket
+        self.user = user
+        self.rooms: tuple[int, ...] = ()
+        self.durable: deque[dict] | None = None
+        self.ephemeral: dict[tuple, dict] | None = None
+        self.closed = False
+        self._writer: asyncio.Task | None = None
+        self._manager = manager
+
+    @property
+    def user_id(self) -> int:
+        return self.user.id
+
+    @property
+    def username(self) -> str:
+        return self.user.username
+
+    def put(self, message: dict):
+        if self.closed:
             return
-        dead_connections = []
-        for ws, _ in self.active_connections[room_id]:
+        manager = self._manager
+        stats = manager.delivery_stats
+        backlog = len(self.durable) if self.durable else 0
+        if message["type"] in EPHEMERAL_TYPES:
+            if backlog >= manager.shed_threshold:
+                stats["ephemeral_shed"] += 1
+                return
+            if self.ephemeral is None:
+                self.ephemeral = {}
+            key = coalesce_key(message)
+            if self.ephemeral.pop(key, None) is not None:
+                stats["ephemeral_superseded"] += 1
+            self.ephemeral[key] = message
+        elif backlog >= manager.max_durable:
+            # Hopelessly behind: stop queueing, the writer drops the connection
+            stats["slow_connections_dropped"] += 1
+            self.closed = True
+        else:
+            if self.durable is None:
+                self.durable = deque()
+            self.durable.append(message)
+            if backlog + 1 >= manager.shed_threshold and self.ephemeral:
+                stats["ephemeral_shed"] += len(self.ephemeral)
+                self.ephemeral = None
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._drain())
+
+    def _next(self) -> dict | None:
+        if self.durable:
+            return self.durable.popleft()
+        if self.ephemeral:
+            return self.ephemeral.pop(next(iter(self.ephemeral)))
+        # Drained: give the queue memory back
+        self.durable = self.ephemeral = None
+        return None
+
+    async def _drain(self):
+        try:
+            message = self._next()
+            while message is not None and not self.closed:
+                await self.websocket.send_json(message)
+                message = self._next()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.info("Connection: send failed, dropping connection")
+            self.closed = True
+        self._writer = None
+        if self.closed:
+            self._manager._drop(self)
             try:
-                await ws.send_json(message)
+                # 1013 = try again later; lets a lagging client reconnect and resync
+                await asyncio.wait_for(self.websocket.close(code=1013), timeout=1)
             except Exception:
-                dead_connections.append(ws)
+                pass
+
+    def close(self):
+        self.closed = True
+        self.durable = self.ephemeral = None
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        max_durable: int = 1000,
+        shed_threshold: int = 100,
+        max_typing: int = 20,
+        on_connection_lost: Callable[[WebSocket], None] | None = None,
+    ):
+        self.connections: dict[WebSocket, Connection] = {}
+        self.active_connections: dict[int, set[Connection]] = {}  # room_id -> connections
+        self.user_connections: dict[int, list[Connection]] = {}   # user_id -> connections (any room)
+        self.users: dict[int, UserRef] = {}                        # interned, while the user is connected
+        self.typing_users: dict[int, set[int]] = {}                # room_id -> user_ids, at most max_typing
+        self.pending_joins: dict[int, list[str]] = {}  # room_id -> usernames not yet announced
+        self._join_flush_tasks: dict[int, asyncio.Task] = {}  # room_id -> task announcing pending_joins
+        self.max_durable = max_durable
+        self.shed_threshold = shed_threshold
+        self.max_typing = max_typing
+        self.on_connection_lost = on_connection_lost  # full cleanup (presence etc.) for dead writers
+        self.delivery_stats = {"ephemeral_superseded": 0, "ephemeral_shed": 0, "slow_connections_dropped": 0}
+        self._conn_ids = itertools.count(1)
 
-        # Cleanup dead connections
-        if dead_connections:
-            self.active_connections[room_id] = [
-                (ws, u) for ws, u in self.active_connections[room_id] if ws not in dead_connections
-            ]
-            if not self.active_connections[room_id]:
-                del self.active_connections[room_id]
+    async def connect(self, websocket: WebSocket, room_id: int, user: User) -> Connection:
+        """Register a websocket for a user in a room. Only the user's id and name are kept."""
+        conn = self.connections.get(websocket)
+        if conn is None:
+            ref = self.users.get(user.id)
+            if ref is None:
+                ref = self.users[user.id] = UserRef(user.id, user.username)
+            conn = Connection(next(self._conn_ids), websocket, ref, self)
+            self.connections[websocket] = conn
+            self.user_connections.setdefault(user.id, []).append(conn)
+        if room_id not in conn.rooms:
+            conn.rooms += (room_id,)
+            self.active_connections.setdefault(room_id, set()).add(conn)
+        return conn
 
-    def get_users_in_room(self, room_id: int) -> list[User]:
+    def disconnect(self, websocket: WebSocket, room_id: int, user: UserRef | User) -> bool:
+        """Remove a websocket connection when user disconnects. Returns False if it was already gone."""
+        conn = self.connections.get(websocket)
+        if conn is None or room_id not in conn.rooms:
+            return False
+        self._leave_room(conn, room_id)
+        if not conn.rooms:
+            self._forget(conn)
+            conn.close()
+        return True
+
+    def _leave_room(self, conn: Connection, room_id: int):
+        conn.rooms = tuple(r for r in conn.rooms if r != room_id)
+        conns = self.active_connections.get(room_id)
+        if conns is None:
+            return
+        conns.discard(conn)
+        # Stop showing the user as typing unless another tab is still in the room
+        if conn.user.id not in self.connected_user_ids(room_id):
+            self.set_typing(room_id, conn.user.id, False)
+        # Clean up empty room
+        if not conns:
+            del self.active_connections[room_id]
+            self.typing_users.pop(room_id, None)
+
+    def _forget(self, conn: Connection):
+        self.connections.pop(conn.websocket, None)
+        user_id = conn.user.id
+        conns = self.user_connections.get(user_id)
+        if conns is not None:
+            if conn in conns:
+                conns.remove(conn)
+            if not conns:
+                del self.user_connections[user_id]
+                self.users.pop(user_id, None)
+
+    def _drop(self, conn: Connection):
+        """Forget a connection whose writer died (send failed or too far behind)."""
+        if self.on_connection_lost is not None:
+            self.on_connection_lost(conn.websocket)  # full disconnect, which forgets it
+            return
+        for room_id in conn.rooms:
+            self._leave_room(conn, room_id)
+        self._forget(conn)
+
+    def send(self, websocket: WebSocket, message: dict):
+        """Queue a message for one connection, honouring its delivery class."""
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            conn.put(message)
+
+    def send_to_user(self, user_id: int, message: dict):
+        """Queue a message for every connection of a user, whatever room it is in."""
+        for conn in self.user_connections.get(user_id, ()):
+            conn.put(message)
+
+    async def broadcast(self, room_id: int, message: dict):
+        """Queue a message for all users in a room."""
+        for conn in self.active_connections.get(room_id, ()):
+            conn.put(message)
+
+    def get_users_in_room(self, room_id: int) -> list[UserRef]:
         """Return list of connected users in a room."""
-        return [u for _, u in self.active_connections.get(room_id, [])]
-    
+        return [conn.user for conn in self.active_connections.get(room_id, ())]
+
+    def connections_of(self, websocket: WebSocket) -> list[tuple[int, UserRef]]:
+        """Return (room_id, user) for every room this websocket is registered in."""
+        conn = self.connections.get(websocket)
+        return [(room_id, conn.user) for room_id in conn.rooms] if conn else []
+
+    def connected_user_ids(self, room_id: int) -> set[int]:
+        return {conn.user.id for conn in self.active_connections.get(room_id, ())}
 
     def get_user_ws(self, room_id: int, user_id: int):
         """Return the WebSocket for a specific user in a room (if connected)."""
-        for ws, user in self.active_connections.get(room_id, []):
-            if user.id == user_id:
-                return ws
+        for conn in self.active_connections.get(room_id, ()):
+            if conn.user.id == user_id:
+                return conn.websocket
         return None
-    
 
     # --- Typing helpers ---
-    def set_typing(self, room_id: int, user_id: int, is_typing: bool):
-        if room_id not in self.typing_users:
-            self.typing_users[room_id] = set()
-
+    def set_typing(self, room_id: int, user_id: int, is_typing: bool) -> bool:
+        """Returns whether the room's typing set changed."""
+        typing = self.typing_users.get(room_id)
         if is_typing:
-            self.typing_users[room_id].add(user_id)
-        else:
-            self.typing_users[room_id].discard(user_id)
-
+            if typing is None:
+                typing = self.typing_users[room_id] = set()
+            # Bounded: past max_typing the indicator reads the same anyway
+            if user_id in typing or len(typing) >= self.max_typing:
+                return False
+            typing.add(user_id)
+            return True
+        if typing is None or user_id not in typing:
+            return False
+        typing.discard(user_id)
+        if not typing:
+            del self.typing_users[room_id]
+        return True
 
     def list_typing_usernames(self, room_id: int) -> list[str]:
-        # map ids -> usernames from current connections
-        id_to_name = {u.id: u.username for _, u in self.active_connections.get(room_id, [])}
-        return [id_to_name[uid] for uid in self.typing_users.get(room_id, set()) if uid in id_to_name]
-    
+        return [self.users[uid].username for uid in self.typing_users.get(room_id, ()) if uid in self.users]
 
     async def broadcast_online_status(self, room_id: int):
-        users = [u.username for _, u in self.active_connections.get(room_id, [])]
-        for ws, _ in self.active_connections.get(room_id, []):
-            await ws.send_json({
-                "type": "online_status",
-                "room_id": room_id,
-                "users": users
-            })
+        users = sorted(conn.user.username for conn in self.active_connections.get(room_id, ()))
+        await self.broadcast(room_id, {
+            "type": "online_status",
+            "room_id": room_id,
+            "users": users
+        })
+
+    # --- Join announcements ---
+    async def announce_join(self, room_id: int, username: str, batch_window: float | None = None):
+        """
+        Broadcast presence and a "joined" system message. With `batch_window`,
+        joins to the same room within that many seconds share one announcement.
+        """
+        if batch_window is None:
+            await self._announce_joins(room_id, [username])
+            return
+        if room_id in self.pending_joins:
+            self.pending_joins[room_id].append(username)
+            return
+        self.pending_joins[room_id] = [username]
+        self._join_flush_tasks[room_id] = asyncio.create_task(self._flush_joins(room_id, batch_window))
+
+    async def _flush_joins(self, room_id: int, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            await self._announce_joins(room_id, self.pending_joins.pop(room_id, []))
+        finally:
+            self._join_flush_tasks.pop(room_id, None)
+
+    def close(self):
+        """Cancel pending join announcements (server shutdown)."""
+        for task in list(self._join_flush_tasks.values()):
+            task.cancel()
+        self._join_flush_tasks.clear()
+        self.pending_joins.clear()
+
+    async def _announce_joins(self, room_id: int, usernames: list[str]):
+        await self.broadcast_online_status(room_id)
+        if len(usernames) == 1:
+            who = usernames[0]
+        elif len(usernames) <= 3:
+            who = f"{', '.join(usernames[:-1])} and {usernames[-1]}"
+        else:
+            who = f"{', '.join(usernames[:2])} and {len(usernames) - 2} others"
+        await self.broadcast(room_id, {
+            "type": "system",
+            "room_id": room_id,
+            "message": f"{who} joined the room.",
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "users": len(self.users),
+            "writing": sum(1 for c in self.connections.values() if c._writer is not None),
+            "queued_durable": sum(len(c.durable) for c in self.connections.values() if c.durable),
+            "queued_ephemeral": sum(len(c.ephemeral) for c in self.connections.values() if c.ephemeral),
+            **self.delivery_stats,
+        }
 
@@ -0,0 +1,95 @@
+# app/utils/file_response.py
+import os
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parse a single `bytes=` range into inclusive (start, end).
+    Returns None for no/unsupported ranges (serve the whole file).
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if not start_s:  # suffix range: last N bytes
+            length = int(end_s)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """
+    Serve a file (or one byte range of it) without reading it into memory.
+    Uses the ASGI zero-copy extensions when the server offers them
+    (`http.response.pathsend` for whole files, `http.response.zerocopysend` for
+    ranges) and otherwise streams it in chunks. The pinned uvicorn (0.19)
+    advertises neither, so under it every response takes the chunked path.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, request_headers: Headers, media_type: str, headers: dict | None = None):
+        self.path = path
+        self.media_type = media_type
+        size = os.stat(path).st_size
+        headers = {"Accept-Ranges": "bytes", **(headers or {})}
+
+        self.start, self.end = 0, size - 1
+        status_code = 200
+        try:
+            byte_range = parse_range(request_headers.get("range", ""), size)
+        except RangeNotSatisfiable:
+            byte_range = None
+            status_code = 416
+            headers["Content-Range"] = f"bytes */{size}"
+            self.start, self.end = 0, -1
+        if byte_range is not None and request_headers.get("if-range", headers.get("ETag")) == headers.get("ETag"):
+            self.start, self.end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {self.start}-{self.end}/{size}"
+
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.headers["content-length"] = str(self.end - self.start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        extensions = scope.get("extensions", {})
+
+        if count <= 0 or scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+        elif self.status_code == 200 and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": self.path})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.zerocopysend", "file": f.fileno(), "offset": self.start, "count": count})
+        else:
+            async with await anyio.open_file(self.path, "rb") as f:
+                await f.seek(self.start)
+                remaining = count
+                while remaining > 0:
+                    chunk = await f.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining > 0:
+                    await send({"type": "http.response.body", "body": b""})
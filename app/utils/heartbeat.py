@@ -0,0 +1,79 @@
+# app/utils/heartbeat.py
+import asyncio
+import logging
+import time
+from typing import Callable, Hashable
+
+from app.utils.timing_wheel import TimingWheel
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatMonitor:
+    """
+    Application-level ping/pong for WebSocket connections, driven by one TimingWheel.
+
+    Any frame from the client counts as activity (`touch` is just a timestamp
+    update). When a connection's timer fires it is either re-armed for the rest
+    of its idle interval, pinged, or - if a ping went unanswered for `timeout`
+    seconds - evicted.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        timeout: float,
+        tick: float,
+        on_ping: Callable[[Hashable], None],
+        on_evict: Callable[[Hashable], None],
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self.wheel = TimingWheel(tick)
+        self.on_ping = on_ping
+        self.on_evict = on_evict
+        self.last_seen: dict[Hashable, float] = {}
+        self.awaiting_pong: set[Hashable] = set()
+        self.stats = {"pings_sent": 0, "evicted": 0}
+
+    def register(self, key: Hashable):
+        self.last_seen[key] = time.monotonic()
+        self.wheel.schedule(key, self.interval)
+
+    def unregister(self, key: Hashable):
+        self.wheel.cancel(key)
+        self.last_seen.pop(key, None)
+        self.awaiting_pong.discard(key)
+
+    def touch(self, key: Hashable):
+        if key in self.last_seen:
+            self.last_seen[key] = time.monotonic()
+            self.awaiting_pong.discard(key)
+
+    def tick(self):
+        now = time.monotonic()
+        for key in self.wheel.advance():
+            idle = now - self.last_seen[key]
+            if key in self.awaiting_pong:
+                self.unregister(key)
+                self.stats["evicted"] += 1
+                self.on_evict(key)
+            elif idle < self.interval:
+                self.wheel.schedule(key, self.interval - idle)
+            else:
+                self.awaiting_pong.add(key)
+                self.stats["pings_sent"] += 1
+                self.on_ping(key)
+                self.wheel.schedule(key, self.timeout)
+
+    async def run(self):
+        """Background task: advance the wheel every tick."""
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("heartbeat tick failed")
+
+    def get_stats(self) -> dict:
+        return {"tracked": len(self.last_seen), "awaiting_pong": len(self.awaiting_pong), **self.stats}
@@ -0,0 +1,97 @@
+# app/utils/http_cache.py
+import uuid
+from collections import OrderedDict
+from typing import Callable
+
+from fastapi import Request
+from fastapi.responses import HTMLResponse, Response
+
+from app.utils.templates import templates
+
+
+# Changes on every process start so ETags issued before a restart/deploy never match.
+BOOT_ID = uuid.uuid4().hex[:8]
+
+# Rooms pages must be revalidated on every use, but a matching ETag costs no rendering.
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+# Closed history pages never change. Private: only room members may read them.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+class FragmentCache:
+    """Small LRU of rendered template bodies, keyed by ETag."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+
+    def get(self, key: str) -> bytes | None:
+        body = self._entries.get(key)
+        if body is not None:
+            self._entries.move_to_end(key)
+        return body
+
+    def set(self, key: str, body: bytes):
+        self._entries[key] = body
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+fragment_cache = FragmentCache()
+
+# Bumped whenever rooms or memberships change (create_room / join / leave).
+# Kept in-process, like ConnectionManager: assumes a single worker.
+_directory_version = 0
+
+
+def get_directory_version() -> int:
+    return _directory_version
+
+
+def bump_directory_version():
+    """Invalidate every rendered room-list/directory fragment."""
+    global _directory_version
+    _directory_version += 1
+    fragment_cache.clear()
+
+
+def directory_etag(name: str, *parts) -> str:
+    key = "-".join(str(p) for p in (name, BOOT_ID, f"v{_directory_version}", *parts))
+    return f'"{key}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+
+
+def cached_template_response(
+    request: Request,
+    template_name: str,
+    etag: str,
+    build_context: Callable[[], dict],
+    cache: FragmentCache = fragment_cache,
+    cache_control: str = REVALIDATE_CACHE_CONTROL,
+) -> Response:
+    """
+    Conditional GET for a rendered template:
+    304 if the client already has `etag`, the cached body if we rendered it before,
+    otherwise call `build_context()` (the DB work) and render.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    body = cache.get(etag)
+    if body is None:
+        context = build_context()
+        body = templates.TemplateResponse(template_name, {"request": request, **context}).body
+        cache.set(etag, body)
+    return HTMLResponse(content=body, headers=headers)
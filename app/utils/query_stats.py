@@ -0,0 +1,123 @@
+# app/utils/query_stats.py
+"""
+Per-route SQL accounting. Engine events count and time every statement executed
+while a scope is active; scopes are HTTP routes (QueryStatsMiddleware, labelled
+by path template, e.g. "GET /chat/rooms/{room_id}") and WebSocket events
+(`track("WS message")` in chat_ws). Off unless `settings.query_stats_enabled`.
+"""
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class ScopeLog:
+    """Statements executed during one request / one WebSocket event."""
+
+    def __init__(self):
+        self.statements: list[str] = []
+        self.seconds = 0.0
+
+    def record(self, statement: str, seconds: float):
+        self.statements.append(" ".join(statement.split()))
+        self.seconds += seconds
+
+
+_current: ContextVar[ScopeLog | None] = ContextVar("query_scope", default=None)
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.routes: dict[str, dict] = {}
+        self.enabled = False
+
+    def install(self, engine: Engine):
+        self.enabled = True
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        log = _current.get()
+        if log is not None:
+            log.record(statement, time.perf_counter() - conn.info["query_started"].pop())
+
+    @contextmanager
+    def track(self, label: str):
+        if not self.enabled:
+            yield None
+            return
+        log = ScopeLog()
+        token = _current.set(log)
+        try:
+            yield log
+        finally:
+            _current.reset(token)
+            self.add(label, log)
+
+    def add(self, label: str, log: ScopeLog):
+        entry = self.routes.get(label)
+        if entry is None:
+            entry = self.routes[label] = {"calls": 0, "queries": 0, "max_queries": 0, "seconds": 0.0, "statements": Counter()}
+        entry["calls"] += 1
+        entry["queries"] += len(log.statements)
+        entry["max_queries"] = max(entry["max_queries"], len(log.statements))
+        entry["seconds"] += log.seconds
+        entry["statements"].update(log.statements)
+
+    def report(self) -> dict:
+        """Plain, key-sorted data; stable enough to diff between runs."""
+        return {
+            label: {
+                "calls": entry["calls"],
+                "queries": entry["queries"],
+                "max_queries": entry["max_queries"],
+                "ms": round(entry["seconds"] * 1000, 2),
+                "statements": dict(sorted(entry["statements"].items())),
+            }
+            for label, entry in sorted(self.routes.items())
+        }
+
+    def reset(self):
+        self.routes.clear()
+
+
+query_recorder = QueryRecorder()
+track = query_recorder.track
+
+
+class QueryStatsMiddleware:
+    """Attribute the SQL of each HTTP request to its route template."""
+
+    def __init__(self, app: ASGIApp, recorder: QueryRecorder = query_recorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        log = ScopeLog()
+        token = _current.set(log)  # copied into threadpool endpoints with the context
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            self.recorder.add(f"{scope['method']} {self._route_path(scope)}", log)
+
+    @staticmethod
+    def _route_path(scope: Scope) -> str:
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return scope["path"]
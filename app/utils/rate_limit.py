@@ -0,0 +1,99 @@
+# app/utils/rate_limit.py
+import time
+from collections import defaultdict
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens/sec refill, holds at most `burst` tokens."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def allow(self, now: float | None = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Seconds until the next token is available."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class FloodControl:
+    """
+    Rate limits WebSocket events per connection and per room, with a separate
+    (rate, burst) budget for each event type. An event must pass both buckets.
+    Event types without a budget are never limited and are counted together
+    under OTHER, so client-chosen type names can't grow the counters.
+    """
+
+    OTHER = "other"
+
+    def __init__(self, connection_budgets: dict[str, tuple[float, float]], room_budgets: dict[str, tuple[float, float]]):
+        self.connection_budgets = connection_budgets
+        self.room_budgets = room_budgets
+        self._connection_buckets: dict[int, dict[str, TokenBucket]] = {}
+        self._room_buckets: dict[int, dict[str, TokenBucket]] = {}
+        # event_type -> {"allowed": n, "throttled_connection": n, "throttled_room": n}
+        self.counters: dict[str, dict[str, int]] = defaultdict(
+            lambda: {"allowed": 0, "throttled_connection": 0, "throttled_room": 0}
+        )
+
+    @staticmethod
+    def _bucket(buckets: dict, key: int, event_type: str, budgets: dict) -> TokenBucket | None:
+        budget = budgets.get(event_type)
+        if budget is None:
+            return None
+        per_key = buckets.setdefault(key, {})
+        bucket = per_key.get(event_type)
+        if bucket is None:
+            bucket = per_key[event_type] = TokenBucket(*budget)
+        return bucket
+
+    def allow(self, connection_key: int, room_id: int, event_type: str) -> bool:
+        now = time.monotonic()
+        if event_type not in self.connection_budgets and event_type not in self.room_budgets:
+            event_type = self.OTHER
+        counters = self.counters[event_type]
+
+        bucket = self._bucket(self._connection_buckets, connection_key, event_type, self.connection_budgets)
+        if bucket is not None and not bucket.allow(now):
+            counters["throttled_connection"] += 1
+            return False
+
+        bucket = self._bucket(self._room_buckets, room_id, event_type, self.room_budgets)
+        if bucket is not None and not bucket.allow(now):
+            counters["throttled_room"] += 1
+            return False
+
+        counters["allowed"] += 1
+        return True
+
+    def retry_after(self, connection_key: int, room_id: int, event_type: str) -> float:
+        buckets = [
+            self._connection_buckets.get(connection_key, {}).get(event_type),
+            self._room_buckets.get(room_id, {}).get(event_type),
+        ]
+        return max((b.retry_after() for b in buckets if b is not None), default=0.0)
+
+    def forget_connection(self, connection_key: int):
+        self._connection_buckets.pop(connection_key, None)
+
+    def forget_room(self, room_id: int):
+        self._room_buckets.pop(room_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "connections_tracked": len(self._connection_buckets),
+            "rooms_tracked": len(self._room_buckets),
+            "events": {event_type: dict(c) for event_type, c in self.counters.items()},
+        }
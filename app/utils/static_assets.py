@@ -0,0 +1,123 @@
+# app/utils/static_assets.py
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli  # optional: enables "br" variants
+except ImportError:  # pragma: no cover - brotli is not a hard requirement
+    brotli = None
+
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class StaticAsset:
+    """A static file loaded into memory with its content-hashed name and precompressed bodies."""
+
+    def __init__(self, path: str, hashed_path: str, media_type: str, etag: str, bodies: dict[str, bytes]):
+        self.path = path
+        self.hashed_path = hashed_path
+        self.media_type = media_type
+        self.etag = etag
+        self.bodies = bodies  # content-encoding -> bytes ("identity", "gzip", "br")
+
+
+def _hashed_name(path: str, digest: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+
+def build_asset_manifest(directory: str) -> dict[str, StaticAsset]:
+    """
+    Walk the static directory once and return {logical_path: StaticAsset}.
+    Compressed variants are only kept when they are actually smaller.
+    """
+    assets: dict[str, StaticAsset] = {}
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            full_path = os.path.join(root, filename)
+            path = os.path.relpath(full_path, directory).replace(os.sep, "/")
+            with open(full_path, "rb") as f:
+                data = f.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            bodies = {"identity": data}
+            if media_type.startswith(COMPRESSIBLE_TYPES):
+                gz = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(gz) < len(data):
+                    bodies["gzip"] = gz
+                if brotli is not None:
+                    br = brotli.compress(data, quality=11)
+                    if len(br) < len(data):
+                        bodies["br"] = br
+
+            assets[path] = StaticAsset(
+                path=path,
+                hashed_path=_hashed_name(path, digest),
+                media_type=media_type,
+                etag=f'"{digest}"',
+                bodies=bodies,
+            )
+    return assets
+
+
+def _accepted_encodings(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class HashedStaticFiles(StaticFiles):
+    """
+    StaticFiles that also serves content-hashed names (e.g. js/chat.3f2a9c1d0b4e.js)
+    from memory, precompressed and with immutable caching.
+    Unhashed paths fall back to the regular StaticFiles behaviour.
+    """
+
+    def __init__(self, *, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.assets = build_asset_manifest(directory)
+        self.hashed_assets = {a.hashed_path: a for a in self.assets.values()}
+
+    def hashed_path(self, path: str) -> str:
+        """Map a logical path ("js/chat.js") to its content-hashed name."""
+        asset = self.assets.get(path)
+        return asset.hashed_path if asset else path
+
+    async def get_response(self, path: str, scope) -> Response:
+        asset = self.hashed_assets.get(path.replace(os.sep, "/"))
+        if asset is None:
+            return await super().get_response(path, scope)
+
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+
+        request_headers = Headers(scope=scope)
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+            "ETag": asset.etag,
+            "Vary": "Accept-Encoding",
+        }
+        if asset.etag in request_headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding in asset.bodies and encoding in accepted:
+                headers["Content-Encoding"] = encoding
+                return Response(asset.bodies[encoding], media_type=asset.media_type, headers=headers)
+        return Response(asset.bodies["identity"], media_type=asset.media_type, headers=headers)
@@ -0,0 +1,43 @@
+# app/utils/timing_wheel.py
+import math
+from typing import Hashable
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel. Timers live in `slots` buckets indexed by due tick modulo
+    the wheel size, so schedule/cancel are O(1) and each tick only looks at one
+    bucket, however many timers exist. Timers further than one revolution away
+    stay in their bucket until their round comes up.
+    """
+
+    def __init__(self, tick: float, slots: int = 512):
+        self.tick = tick
+        self.slots: list[dict[Hashable, int]] = [{} for _ in range(slots)]
+        self.current = 0  # ticks elapsed
+        self.due: dict[Hashable, int] = {}  # key -> due tick
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    def schedule(self, key: Hashable, delay: float):
+        """(Re)arm the timer for `key` to fire after `delay` seconds."""
+        self.cancel(key)
+        due = self.current + max(1, math.ceil(delay / self.tick))
+        self.slots[due % len(self.slots)][key] = due
+        self.due[key] = due
+
+    def cancel(self, key: Hashable):
+        due = self.due.pop(key, None)
+        if due is not None:
+            self.slots[due % len(self.slots)].pop(key, None)
+
+    def advance(self) -> list[Hashable]:
+        """Move one tick forward and return the keys whose timers fired."""
+        self.current += 1
+        slot = self.slots[self.current % len(self.slots)]
+        expired = [key for key, due in slot.items() if due <= self.current]
+        for key in expired:
+            del slot[key]
+            del self.due[key]
+        return expired